@@ -1,12 +1,141 @@
 import cv2
 import numpy as np
-from detect_objects import detect_objects
+from detect_objects import THRESHOLDS, detect_objects_batch, rider_class_ids, split_riders
 from tracking import initialize_tracker, update_tracker
 from trapezium import create_trapezium
-from utils import assign_riders_to_motorcycles
-from helmet_detection import detect_helmets
+from utils import assign_riders_to_motorcycles, iou_matrix
+from helmet_detection import detect_helmets_batch
+from pipeline import batched
+from process_video import read_frames
+from events import EventWriter, helmet_counts, trapezium_event
+
+def annotate_frame(frame, motorcycles, riders, vehicle_tracker, helmet_tracker, helmet_model, verdict_cache=None,
+                   events=None, draw=True, helmet_imgsz=640):
+    """
+    Tracks, checks and annotates one frame given its motorcycle and rider detections.
+
+    :param verdict_cache: Optional VerdictCache; confirmed tracks with a valid cached verdict
+                          skip trapezium construction and helmet detection.
+    :param events: Optional list that receives one (track_id, trapezium, (riders, helmets, no_helmets),
+                   triple_riding) tuple per tracked motorcycle with riders.
+    :param draw: Draw onto the frame. Without drawing, helmets are not tracked either.
+    :param helmet_imgsz: Input size of the helmet model, see detect_helmets_batch.
+    """
+    # Assign riders to motorcycles
+    assignments = assign_riders_to_motorcycles(motorcycles, riders)
+
+    # Track motorcycles using DeepSORT
+    motorcycle_tracks = update_tracker(vehicle_tracker, motorcycles, frame, skip_motorcycles=False)
+    if verdict_cache is not None:
+        verdict_cache.evict(track.track_id for track in motorcycle_tracks)
+
+    # Link every track updated this frame to the motorcycle detection it was updated with
+    detection_of = {}
+    updated = [track for track in motorcycle_tracks if track.is_confirmed() and track.time_since_update == 0]
+    if updated and len(motorcycles):
+        detected_boxes = np.array([track.to_ltrb(orig=True) for track in updated], np.float32)
+        ious = iou_matrix(detected_boxes, motorcycles.xyxy)
+        for i, track in enumerate(updated):
+            m = int(np.argmax(ious[i]))
+            if ious[i, m] > 0.5:
+                detection_of[track.track_id] = m
+
+    # Build a trapezium for every confirmed motorcycle that has riders assigned
+    confirmed = []
+    trapeziums = []
+    pending = []
+    for track in motorcycle_tracks:
+        if not track.is_confirmed():
+            continue
+
+        ltrb = track.to_ltrb()
+
+        # Reuse the cached verdict while the motorcycle is stable
+        cached = verdict_cache.lookup(track.track_id, ltrb) if verdict_cache is not None else None
+        if cached is not None:
+            trapezium, helmet_detections, rider_count = cached
+            confirmed.append([track, ltrb, trapezium, helmet_detections, rider_count])
+            continue
+
+        # Get riders assigned to this motorcycle
+        trapezium = None
+        rider_count = 0
+        m = detection_of.get(track.track_id)
+        if m is not None and m in assignments:
+            riders_assigned = assignments[m]
+            
+            # Create trapezium around motorcycle + riders
+            trapezium = create_trapezium(motorcycles[m], riders_assigned)
+            trapeziums.append(trapezium)
+            rider_count = len(riders_assigned)
+            pending.append((len(confirmed), rider_count))
+        confirmed.append([track, ltrb, trapezium, None, rider_count])
+
+    # Detect helmets inside the new or changed trapezium regions with one batched call
+    helmet_results = detect_helmets_batch(frame, helmet_model, trapeziums, helmet_imgsz)
+    for (i, rider_count), helmet_detections in zip(pending, helmet_results):
+        track, ltrb, trapezium = confirmed[i][:3]
+        confirmed[i][3] = helmet_detections
+        if verdict_cache is not None:
+            verdict_cache.store(track.track_id, ltrb, trapezium, helmet_detections, rider_count)
+
+    if events is not None:
+        for track, ltrb, trapezium, helmet_detections, rider_count in confirmed:
+            if trapezium is not None:
+                counts = (rider_count,) + helmet_counts(helmet_detections)
+                triple_riding = rider_count > THRESHOLDS['max_riders'] or len(helmet_detections) > THRESHOLDS['max_riders']
+                events.append((track.track_id, trapezium, counts, triple_riding))
+
+    if not draw:
+        return frame
+
+    # Draw tracked motorcycles and link trapezium bounding boxes
+    for track, ltrb, trapezium, helmet_detections, _ in confirmed:
+        # Draw bounding box for motorcycle
+        cv2.rectangle(frame, (int(ltrb[0]), int(ltrb[1])), (int(ltrb[2]), int(ltrb[3])), (255, 0, 0), 2)
+        cv2.putText(frame, f"Motorcycle {track.track_id}", (int(ltrb[0]), int(ltrb[1]) - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+
+        if trapezium is not None:
+            pts = np.array(trapezium, np.int32).reshape((-1, 1, 2))
+            cv2.polylines(frame, [pts], isClosed=True, color=(0, 255, 0), thickness=2)
+
+            # Track helmets using DeepSORT
+            helmet_tracks = update_tracker(helmet_tracker, helmet_detections, frame)
+
+            for helmet_track in helmet_tracks:
+                if not helmet_track.is_confirmed():
+                    continue
+                
+                ltrb = helmet_track.to_ltrb()
+                label = "Helmet" if helmet_track.det_class == "Helmet" else "No Helmet"
+                color = (0, 255, 0) if label == "Helmet" else (0, 0, 255)
+
+                cv2.rectangle(frame, (int(ltrb[0]), int(ltrb[1])), (int(ltrb[2]), int(ltrb[3])), color, 2)
+                cv2.putText(frame, label, (int(ltrb[0]), int(ltrb[1]) - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+
+    return frame
+
+def process_video(video_path, vehicle_model, rider_model, helmet_model, output_path="output_video.mp4",
+                  batch_size=1, max_wait=None, verdict_cache=None, tracker_backend="deepsort",
+                  events_path=None, headless=False, rider_classes=None, helmet_imgsz=640):
+    """
+    Tracks motorcycles and their riders' helmets in a video and writes the annotated result.
+
+    Pass rider_model=None to run a single merged vehicle + rider model given as vehicle_model.
+
+    :param batch_size: Number of frames the vehicle and rider models run on at once.
+    :param max_wait: Maximum seconds to wait for a batch to fill before running a partial one.
+    :param verdict_cache: Optional VerdictCache of per-track helmet and rider verdicts.
+    :param tracker_backend: Tracker backend for tracking.initialize_tracker ("deepsort" or "iou").
+    :param events_path: Write one trapezium event per tracked motorcycle and frame to this
+                        .jsonl or .parquet file.
+    :param headless: Only write events; skip drawing, helmet tracking and video encoding.
+    :param rider_classes: Rider class IDs of the merged model. By default its classes named "rider".
+    :param helmet_imgsz: Input size of the helmet model, see detect_helmets_batch.
+    """
+    if headless and events_path is None:
+        raise ValueError("headless mode needs an events_path")
 
-def process_video(video_path, vehicle_model, rider_model, helmet_model, output_path="output_video.mp4"):
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print("Error: Could not open video!")
@@ -16,72 +145,64 @@ def process_video(video_path, vehicle_model, rider_model, helmet_model, output_p
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = cap.get(cv2.CAP_PROP_FPS)
     
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-    
-    # Initialize DeepSORT trackers
-    vehicle_tracker = initialize_tracker()
-    helmet_tracker = initialize_tracker()
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Detect motorcycles and riders
-        motorcycles = [d for d in detect_objects(vehicle_model, frame) if d['class'] == 3]
-        riders = [d for d in detect_objects(rider_model, frame) if d['class'] == 0]
-
-        # Assign riders to motorcycles
-        assignments = assign_riders_to_motorcycles(motorcycles, riders)
-
-        # Track motorcycles using DeepSORT
-        motorcycle_tracks = update_tracker(vehicle_tracker, motorcycles, frame)
-
-        # Draw tracked motorcycles and link trapezium bounding boxes
-        for track in motorcycle_tracks:
-            if not track.is_confirmed():
-                continue
-
-            ltrb = track.to_ltrb()
-            motorcycle_bbox = {'x': ltrb[0], 'y': ltrb[1], 'w': ltrb[2] - ltrb[0], 'h': ltrb[3] - ltrb[1]}
-
-            # Draw bounding box for motorcycle
-            cv2.rectangle(frame, (int(ltrb[0]), int(ltrb[1])), (int(ltrb[2]), int(ltrb[3])), (255, 0, 0), 2)
-            cv2.putText(frame, f"Motorcycle {track.track_id}", (int(ltrb[0]), int(ltrb[1]) - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
-
-            # Get riders assigned to this motorcycle
-            if (motorcycle_bbox['x'], motorcycle_bbox['y'], motorcycle_bbox['w'], motorcycle_bbox['h']) in assignments:
-                riders_assigned = assignments[(motorcycle_bbox['x'], motorcycle_bbox['y'], motorcycle_bbox['w'], motorcycle_bbox['h'])]
-                
-                # Create trapezium around motorcycle + riders
-                trapezium = create_trapezium(motorcycle_bbox, riders_assigned)
-                pts = np.array(trapezium, np.int32).reshape((-1, 1, 2))
-                cv2.polylines(frame, [pts], isClosed=True, color=(0, 255, 0), thickness=2)
-
-                # Detect helmets inside the trapezium region
-                helmet_detections = detect_helmets(frame, helmet_model, trapezium)
-
-                # Track helmets using DeepSORT
-                helmet_tracks = update_tracker(helmet_tracker, helmet_detections, frame)
-
-                for helmet_track in helmet_tracks:
-                    if not helmet_track.is_confirmed():
-                        continue
-                    
-                    ltrb = helmet_track.to_ltrb()
-                    label = "Helmet" if helmet_track.det_class == "Helmet" else "No Helmet"
-                    color = (0, 255, 0) if label == "Helmet" else (0, 0, 255)
-
-                    cv2.rectangle(frame, (int(ltrb[0]), int(ltrb[1])), (int(ltrb[2]), int(ltrb[3])), color, 2)
-                    cv2.putText(frame, label, (int(ltrb[0]), int(ltrb[1]) - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-
-        # Write frame to output video
-        out.write(frame)
+    out = None
+    if not headless:
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    events = EventWriter(events_path) if events_path is not None else None
     
-    cap.release()
-    out.release()
-    print(f"Output video saved to {output_path}")
+    # Initialize trackers
+    vehicle_tracker = initialize_tracker(tracker_backend)
+    helmet_tracker = initialize_tracker(tracker_backend)
+
+    frame_index = 0
+    batches = batched(read_frames(cap), batch_size, max_wait)
+    try:
+        for frames in batches:
+            # Detect motorcycles and riders on the whole batch
+            if rider_model is None:
+                if rider_classes is None:
+                    rider_classes = rider_class_ids(vehicle_model)
+                split = [split_riders(detections, rider_classes) for detections in detect_objects_batch(vehicle_model, frames)]
+                vehicles_batch = [vehicles for vehicles, _ in split]
+                riders_batch = [riders for _, riders in split]
+            else:
+                vehicles_batch = detect_objects_batch(vehicle_model, frames)
+                riders_batch = detect_objects_batch(rider_model, frames)
+
+            for frame, vehicles, rider_detections in zip(frames, vehicles_batch, riders_batch):
+                motorcycles = vehicles[vehicles.cls == THRESHOLDS['motorcycle_class']]
+                riders = rider_detections[rider_detections.cls == THRESHOLDS['rider_class']]
+
+                verdicts = [] if events is not None else None
+                annotate_frame(frame, motorcycles, riders, vehicle_tracker, helmet_tracker, helmet_model, verdict_cache,
+                               verdicts, draw=not headless, helmet_imgsz=helmet_imgsz)
+
+                if events is not None:
+                    timestamp = frame_index / fps if fps else None
+                    events.write([
+                        trapezium_event(frame_index, timestamp, track_id, trapezium, counts, triple_riding)
+                        for track_id, trapezium, counts, triple_riding in verdicts
+                    ])
+
+                # Write frame to output video
+                if out is not None:
+                    out.write(frame)
+                frame_index += 1
+    finally:
+        # Stops the batcher's reader thread before the capture it reads from is released
+        batches.close()
+        cap.release()
+        if out is not None:
+            out.release()
+        if events is not None:
+            events.close()
+    if events is not None:
+        print(f"{events.count} events saved to {events_path}")
+    if verdict_cache is not None:
+        print(f"Verdict cache: {verdict_cache.hits} hits, {verdict_cache.misses} refreshes")
+    if out is not None:
+        print(f"Output video saved to {output_path}")
 
 
 
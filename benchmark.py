@@ -0,0 +1,350 @@
+"""
+Offline benchmarks of the detection pipeline on synthetic video with deterministic stub models.
+
+Runs on a CPU-only box without model weights or network access:
+
+    python benchmark.py --motorcycles 8 --riders 2 --width 1280 --height 720 --frames 200 --json new.json
+    python benchmark.py --compare old.json
+
+Stub models return the same boxes for the same settings on every run, so results of two versions
+of the code can be compared with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import cv2
+import numpy as np
+from detections import Detections
+from utils import assign_riders_to_motorcycles, iou_matrix
+from trapezium import build_trapeziums, create_trapezium
+from helmet_detection import detect_helmets, detect_helmets_batch
+from tracking import initialize_tracker, update_tracker
+from process_video import process_video, tracking_detections
+from events import read_events
+
+RIDER_CLASS = 80  # Rider class of the merged stub model, after the 80 COCO vehicle classes
+INDEX_BITS = 20  # Frame index stamped into the top rows of every synthetic frame
+INDEX_BLOCK = 16  # Side of one index bit, large enough to survive video compression
+
+def _stamp_index(frame, index):
+    if frame.shape[1] < INDEX_BITS * INDEX_BLOCK:
+        return
+    for bit in range(INDEX_BITS):
+        value = 255 if (index >> bit) & 1 else 0
+        frame[:INDEX_BLOCK, bit * INDEX_BLOCK:(bit + 1) * INDEX_BLOCK] = value
+
+def _read_index(image, width, height):
+    """ Frame index stamped into a full synthetic frame, or None for any other image. """
+    if image.shape[:2] != (height, width) or width < INDEX_BITS * INDEX_BLOCK:
+        return None
+    blocks = image[2:INDEX_BLOCK - 2, :INDEX_BITS * INDEX_BLOCK].reshape(INDEX_BLOCK - 4, INDEX_BITS, INDEX_BLOCK, -1)
+    bits = blocks.mean(axis=(0, 2, 3)) > 127
+    return int(sum(1 << bit for bit in range(INDEX_BITS) if bits[bit]))
+
+class SyntheticScene:
+    """ Motorcycles with riders and cars moving in straight lines, bouncing off the frame edges. """
+
+    def __init__(self, width=1280, height=720, motorcycles=4, riders_per_motorcycle=2, cars=2, seed=0):
+        rng = np.random.default_rng(seed)
+        self.width = width
+        self.height = height
+        self.motorcycles = motorcycles
+        self.riders_per_motorcycle = riders_per_motorcycle
+        n = motorcycles + cars
+        self.start = rng.uniform([0.1 * width, 0.3 * height], [0.9 * width, 0.9 * height], size=(n, 2))
+        self.velocity = rng.uniform(-4, 4, size=(n, 2))
+        self.size = np.array([[0.05 * width, 0.12 * height]] * motorcycles + [[0.12 * width, 0.12 * height]] * cars)
+        self.cls = np.array([3] * motorcycles + [2] * cars, np.int64)
+
+    def vehicles(self, frame_index):
+        """ (N, 4) xywh boxes and (N,) classes of the vehicles in a frame. """
+        low = self.size / 2
+        high = np.array([self.width, self.height]) - self.size / 2
+        span = high - low
+        # Reflect the linear motion back into [low, high]
+        position = np.abs((self.start - low + self.velocity * frame_index) % (2 * span) - span)
+        centres = high - position
+        return np.concatenate([centres, self.size], axis=1).astype(np.float32), self.cls
+
+    def riders(self, frame_index):
+        """ (N, 4) xywh boxes of the riders in a frame, sitting on their motorcycles. """
+        vehicles, _ = self.vehicles(frame_index)
+        r = self.riders_per_motorcycle
+        boxes = []
+        for x, y, w, h in vehicles[:self.motorcycles]:
+            for k in range(r):
+                boxes.append([x + (k - (r - 1) / 2) * 0.25 * w, y - 0.35 * h, 0.4 * w, 0.7 * h])
+        return np.array(boxes, np.float32).reshape(-1, 4)
+
+    def write_video(self, path, frames, fps=25):
+        """ Renders frames of the scene as coloured boxes on a grey background. """
+        out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (self.width, self.height))
+        for i in range(frames):
+            frame = np.full((self.height, self.width, 3), 90, np.uint8)
+            vehicles, classes = self.vehicles(i)
+            for (x, y, w, h), c in zip(vehicles, classes):
+                color = (40, 40, 200) if c == 3 else (200, 120, 40)
+                cv2.rectangle(frame, (int(x - w / 2), int(y - h / 2)), (int(x + w / 2), int(y + h / 2)), color, -1)
+            for x, y, w, h in self.riders(i):
+                cv2.rectangle(frame, (int(x - w / 2), int(y - h / 2)), (int(x + w / 2), int(y + h / 2)), (60, 200, 60), 2)
+            _stamp_index(frame, i)
+            out.write(frame)
+        out.release()
+
+class _StubTensor:
+    """ Stands in for a torch tensor: .cpu().numpy() returns the array. """
+
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+    def __len__(self):
+        return len(self.array)
+
+class _StubBoxes:
+    def __init__(self, xywh, conf, cls):
+        xy, wh = xywh[:, :2], xywh[:, 2:]
+        xyxy = np.concatenate([xy - wh / 2, xy + wh / 2], axis=1)
+        self.xywh = _StubTensor(xywh)
+        self.xyxy = _StubTensor(xyxy)
+        self.conf = _StubTensor(conf)
+        self.cls = _StubTensor(cls.astype(np.float32))
+        self.data = _StubTensor(np.concatenate([xyxy, conf[:, None], cls[:, None].astype(np.float32)], axis=1))
+
+class _StubResult:
+    def __init__(self, xywh, conf, cls, names):
+        self.boxes = _StubBoxes(xywh, conf, cls)
+        self.names = names
+
+class StubModel:
+    """
+    Deterministic stand-in for an ultralytics YOLO model.
+
+    "vehicle", "rider" and "merged" models return the scene's boxes for the frame index stamped into
+    the image by SyntheticScene.write_video; for any other image, the boxes of the frame after the
+    previous one, scaled down for downscaled frames. "helmet" models return one helmet or no-helmet
+    box per rider along the top of every crop.
+
+    :param latency: Seconds slept per image, to emulate inference cost.
+    """
+
+    def __init__(self, kind, scene, latency=0.0):
+        self.kind = kind
+        self.scene = scene
+        self.latency = latency
+        self.frame = 0
+        self.calls = 0
+        self.images = 0
+        self.names = {
+            "vehicle": {2: 'car', 3: 'motorcycle'},
+            "rider": {0: 'rider'},
+            "merged": {2: 'car', 3: 'motorcycle', RIDER_CLASS: 'rider'},
+            "helmet": {0: 'Helmet', 1: 'No_Helmet'},
+        }[kind]
+
+    def __call__(self, source, conf=0.35, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        self.calls += 1
+        self.images += len(images)
+        if self.latency:
+            time.sleep(self.latency * len(images))
+        return [self._predict(image) for image in images]
+
+    def _predict(self, image):
+        if self.kind == "helmet":
+            h, w = image.shape[:2]
+            r = self.scene.riders_per_motorcycle
+            xywh = np.array([[(k + 0.5) * w / r, 0.2 * h, 0.6 * w / r, 0.2 * h] for k in range(r)], np.float32).reshape(-1, 4)
+            cls = np.arange(r, dtype=np.int64) % 2
+            return _StubResult(xywh, np.full(r, 0.8, np.float32), cls, self.names)
+
+        frame_index = _read_index(image, self.scene.width, self.scene.height)
+        if frame_index is None:
+            frame_index = self.frame
+        self.frame = frame_index + 1
+        vehicles, vehicle_cls = self.scene.vehicles(frame_index)
+        riders = self.scene.riders(frame_index)
+        rider_cls = np.full(len(riders), RIDER_CLASS if self.kind == "merged" else 0, np.int64)
+        if self.kind == "vehicle":
+            xywh, cls = vehicles, vehicle_cls
+        elif self.kind == "rider":
+            xywh, cls = riders, rider_cls
+        else:
+            xywh, cls = np.concatenate([vehicles, riders]), np.concatenate([vehicle_cls, rider_cls])
+        if image.shape[1] < self.scene.width and image.shape[0] * self.scene.width == image.shape[1] * self.scene.height:
+            xywh = xywh * (image.shape[1] / self.scene.width)  # A downscaled frame
+        return _StubResult(xywh, np.full(len(xywh), 0.9, np.float32), cls, self.names)
+
+def _time(fn, repeat):
+    """ Runs fn repeat times; returns the median and mean time per call in microseconds. """
+    fn()  # Warm-up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples = np.array(samples) * 1e6
+    return {'median_us': float(np.median(samples)), 'mean_us': float(samples.mean()),
+            'per_second': float(1e6 / samples.mean()) if samples.mean() else 0.0}
+
+def benchmark_components(scene, repeat=200):
+    """ Times the per-frame building blocks on one frame of the scene. """
+    vehicles_xywh, vehicle_cls = scene.vehicles(0)
+    vehicles = Detections(vehicles_xywh, cls=vehicle_cls)
+    motorcycles = vehicles[vehicles.cls == 3]
+    riders = Detections(scene.riders(0))
+    frame = np.full((scene.height, scene.width, 3), 90, np.uint8)
+    assignments = assign_riders_to_motorcycles(motorcycles, riders)
+    trapeziums = [create_trapezium(motorcycles[m], rider_list) for m, rider_list in assignments.items()]
+    helmet_model = StubModel("helmet", scene)
+    result = StubModel("vehicle", scene)(frame)[0]
+    tracker = initialize_tracker("iou")
+    tracked = tracking_detections(vehicles[vehicles.cls != 3], trapeziums)
+
+    results = {
+        'detections_from_result': _time(lambda: Detections.from_result(result), repeat),
+        'iou_matrix': _time(lambda: iou_matrix(riders.xyxy, motorcycles.xyxy), repeat),
+        'assign_riders_greedy': _time(lambda: assign_riders_to_motorcycles(motorcycles, riders), repeat),
+        'create_trapezium': _time(lambda: [create_trapezium(motorcycles[m], r) for m, r in assignments.items()], repeat),
+        'build_trapeziums': _time(lambda: build_trapeziums(motorcycles, assignments, frame.shape), repeat),
+        'detect_helmets': _time(lambda: [detect_helmets(frame, helmet_model, t) for t in trapeziums], repeat),
+        'detect_helmets_batch': _time(lambda: detect_helmets_batch(frame, helmet_model, trapeziums), repeat),
+        'iou_tracker_update': _time(lambda: update_tracker(tracker, tracked, frame), repeat),
+    }
+    try:
+        import scipy  # noqa: F401
+        results['assign_riders_optimal'] = _time(
+            lambda: assign_riders_to_motorcycles(motorcycles, riders, method="optimal"), repeat)
+    except ImportError:
+        pass
+    return results
+
+# End-to-end modes: process_video keyword arguments
+END_TO_END = {
+    'serial': {},
+    'batched': {'batch_size': 8},
+    'pipelined': {'pipelined': True, 'batch_size': 8},
+    'stride_2': {'detect_stride': 2, 'motion_threshold': None, 'uncertainty_threshold': None},
+    'stride_3': {'detect_stride': 3, 'motion_threshold': None, 'uncertainty_threshold': None},
+    'headless': {'headless': True},
+    'detect_width_640': {'detect_width': 640},
+    'merged_model': {},
+}
+
+def benchmark_end_to_end(scene, frames, latency=0.0, tracker_backend="iou", modes=None):
+    """
+    Runs process_video on a synthetic video in every mode and reports frames per second.
+
+    Every mode also writes events; 'track_frames' and 'trapezium_frames' count the frames with at
+    least one confirmed track or trapezium, so a mode that loses its tracks does not pass as fast.
+    Stride modes also count 'propagated_frames': frames between two detections that still got
+    trapeziums carried forward by the tracker. 'differing_frames' counts the frames whose events
+    differ from the serial mode's, which always runs first as the reference.
+    """
+    results = {}
+    reference = None
+    with tempfile.TemporaryDirectory() as directory:
+        video_path = os.path.join(directory, "synthetic.mp4")
+        scene.write_video(video_path, frames)
+        modes = list(modes or END_TO_END)
+        for mode in ['serial'] + [mode for mode in modes if mode != 'serial']:
+            kwargs = dict(END_TO_END[mode])
+            kwargs['events_path'] = os.path.join(directory, f"{mode}.jsonl")
+            if mode == 'merged_model':
+                models = (StubModel("merged", scene, latency), None, StubModel("helmet", scene, latency))
+            else:
+                models = (StubModel("vehicle", scene, latency), StubModel("rider", scene, latency),
+                          StubModel("helmet", scene, latency))
+
+            start = time.perf_counter()
+            process_video(video_path, *models, output_path=os.path.join(directory, f"{mode}.mp4"),
+                          tracker_backend=tracker_backend, **kwargs)
+            seconds = time.perf_counter() - start
+            events = list(read_events(kwargs['events_path']))
+            by_frame = {}
+            for event in events:
+                by_frame.setdefault(event['frame'], []).append(event)
+            if reference is None:
+                reference = by_frame
+            trapezium_frames = {event['frame'] for event in events if event['type'] == 'trapezium'}
+            results[mode] = {
+                'seconds': seconds,
+                'fps': frames / seconds,
+                'model_calls': sum(model.calls for model in models if model is not None),
+                'track_frames': len({event['frame'] for event in events if event['type'] == 'track'}),
+                'trapezium_frames': len(trapezium_frames),
+                'differing_frames': sum(1 for frame in set(reference) | set(by_frame)
+                                        if reference.get(frame) != by_frame.get(frame)),
+            }
+            stride = kwargs.get('detect_stride', 1)
+            if stride > 1:
+                # Motion and uncertainty checks are off, so exactly every stride-th frame is detected
+                results[mode]['propagated_frames'] = sum(1 for frame in trapezium_frames if frame % stride)
+    return {mode: results[mode] for mode in modes}
+
+def compare(old, new):
+    """ Prints new vs old timings of two benchmark result dicts. """
+    print(f"{'benchmark':<32}{'old':>12}{'new':>12}{'speedup':>10}")
+    for name, result in new['components'].items():
+        if name in old.get('components', {}):
+            before, after = old['components'][name]['median_us'], result['median_us']
+            print(f"{name:<32}{before:>10.1f}us{after:>10.1f}us{before / after:>9.2f}x")
+    for name, result in new['end_to_end'].items():
+        if name in old.get('end_to_end', {}):
+            before, after = old['end_to_end'][name]['fps'], result['fps']
+            print(f"{name:<32}{before:>8.1f}fps{after:>9.1f}fps{after / before:>9.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TVDS pipeline on synthetic video with stub models.")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--motorcycles", type=int, default=4, help="Motorcycles per frame")
+    parser.add_argument("--riders", type=int, default=2, help="Riders per motorcycle")
+    parser.add_argument("--cars", type=int, default=2, help="Other vehicles per frame")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=200, help="Repetitions of every component benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="Emulated model latency per image, in seconds")
+    parser.add_argument("--tracker", default="iou", help="Tracker backend of the end-to-end runs")
+    parser.add_argument("--modes", nargs="*", choices=list(END_TO_END), help="End-to-end modes to run (default: all)")
+    parser.add_argument("--skip-end-to-end", action="store_true")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Compare against results written earlier with --json")
+    args = parser.parse_args()
+
+    scene = SyntheticScene(args.width, args.height, args.motorcycles, args.riders, args.cars, args.seed)
+    results = {
+        'settings': vars(args),
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'components': benchmark_components(scene, args.repeat),
+        'end_to_end': {} if args.skip_end_to_end else benchmark_end_to_end(
+            scene, args.frames, args.latency, args.tracker, args.modes),
+    }
+
+    for name, result in results['components'].items():
+        print(f"{name:<32}{result['median_us']:>10.1f} us/call")
+    for name, result in results['end_to_end'].items():
+        print(f"{name:<32}{result['fps']:>10.1f} fps  ({result['model_calls']} model calls, "
+              f"tracks on {result['track_frames']}, trapeziums on {result['trapezium_frames']} frames)")
+        if result['differing_frames']:
+            print(f"{'':<32}events differ from serial on {result['differing_frames']} frames")
+        if result.get('propagated_frames') == 0:
+            print(f"Error: {name} carried no trapeziums to the frames between detections!")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,135 @@
 import numpy as np
-from ultralytics import YOLO
+from detections import Detections
+from utils import iou_matrix
+
+# Detection settings shared by the whole pipeline; main.py overrides them from the config file
+THRESHOLDS = {
+    'conf': 0.35,  # Minimum detection confidence of every model
+    'motorcycle_class': 3,  # Motorcycle class of the vehicle model
+    'rider_class': 0,  # Rider class of the rider model
+    'max_riders': 2,  # More riders (or helmets) than this on one motorcycle is triple riding
+}
 
 def detect_objects(model, image):
-    results = model(image,conf=0.35)
-    detections = []
-    
-    for result in results:
-        for box, cls in zip(result.boxes.xywh, result.boxes.cls):  
-            x, y, w, h = box.cpu().numpy()
-            class_id = int(cls.cpu().numpy())
-            detections.append({'x': x, 'y': y, 'w': w, 'h': h, 'class': class_id})
-    
-    return detections
+    """ Runs the model on an image and returns its Detections. """
+    results = model(image,conf=THRESHOLDS['conf'])
+    return Detections.concat([Detections.from_result(result) for result in results])
+
+def detect_objects_batch(model, images, imgsz=None):
+    """
+    Runs the model once on a list of images.
+
+    :param imgsz: Model input size, a side or (height, width); None leaves the model's default (640).
+    :return: One Detections per image, in the same order as the images.
+    """
+    if not images:
+        return []
+    if imgsz is None:
+        results = model(images, conf=THRESHOLDS['conf'])
+    else:
+        results = model(images, conf=THRESHOLDS['conf'], imgsz=imgsz)
+    return [Detections.from_result(result) for result in results]
+
+def _tile_starts(length, tile_size, overlap):
+    """ Evenly spaced start offsets of tiles covering length with at least the given overlap fraction. """
+    if length <= tile_size:
+        return [0]
+    step = tile_size * (1 - overlap)
+    n = int(np.ceil((length - tile_size) / step)) + 1
+    return np.linspace(0, length - tile_size, n).round().astype(int).tolist()
+
+def tile_grid(width, height, tile_size=640, overlap=0.2, far_field=1.0):
+    """
+    Overlapping tiles of a width x height frame.
+
+    :param tile_size: Side of a square tile, best the model's input size so tiles are not scaled down.
+    :param overlap: Fraction of a tile shared with its neighbours; objects up to about this
+                    fraction of a tile are whole in at least one tile.
+    :param far_field: Fraction of the frame height, from the top, that is tiled. Distant objects
+                      are at the top of the frame; the near field is left to the full-frame pass.
+    :return: List of (x1, y1, x2, y2) integer tiles; empty if a single tile would cover the frame.
+    """
+    rows = min(height, int(round(far_field * height)))
+    if rows <= 0 or (width <= tile_size and height <= tile_size):
+        return []
+    tiles = []
+    for y in _tile_starts(rows, tile_size, overlap):
+        for x in _tile_starts(width, tile_size, overlap):
+            tiles.append((x, y, min(x + tile_size, width), min(y + tile_size, height)))
+    return tiles
+
+def non_max_suppression(detections, iou_threshold=0.5):
+    """ Class-aware NMS: drops every box overlapping a more confident box of its class by more than iou_threshold. """
+    if len(detections) < 2:
+        return detections
+    order = np.argsort(-detections.conf, kind='stable')
+    classes = detections.cls[order]
+    ious = iou_matrix(detections.xyxy[order], detections.xyxy[order])
+    ious[classes[:, None] != classes[None, :]] = 0
+
+    keep = np.ones(len(order), bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1:] &= ious[i, i + 1:] <= iou_threshold
+    return detections[np.sort(order[keep])]
+
+def detect_objects_tiled(model, images, tile_size=640, overlap=0.2, far_field=1.0, iou_threshold=0.5):
+    """
+    Runs the model once on every whole image plus its overlapping tiles, for small distant objects.
+
+    Each tile reaches the model at (up to) full resolution instead of the whole frame being
+    scaled down to the model's input size. The whole image is still detected too, for large
+    nearby objects that span several tiles. Boxes cut off by a tile border inside the frame are
+    dropped, since the overlap or the whole-image pass sees those objects whole; the remaining
+    duplicates are merged with NMS.
+
+    :param tile_size, overlap, far_field: Tile layout, see tile_grid.
+    :param iou_threshold: IoU above which two same-class boxes are the same object.
+    :return: One Detections per image, in full-image coordinates.
+    """
+    crops = []
+    owners = []
+    for i, image in enumerate(images):
+        h, w = image.shape[:2]
+        crops.append(image)
+        owners.append((i, (0, 0, w, h), (w, h)))
+        for tile in tile_grid(w, h, tile_size, overlap, far_field):
+            crops.append(image[tile[1]:tile[3], tile[0]:tile[2]])
+            owners.append((i, tile, (w, h)))
+
+    per_image = [[] for _ in images]
+    for (i, (x1, y1, x2, y2), (w, h)), detections in zip(owners, detect_objects_batch(model, crops)):
+        # Tile borders inside the frame; the frame's own edges do not cut objects off
+        xyxy = detections.xyxy
+        inner = np.array([x1 > 0, y1 > 0, x2 < w, y2 < h])
+        cut = (np.abs(xyxy - [0, 0, x2 - x1, y2 - y1]) < 2) & inner
+        per_image[i].append(detections[~cut.any(axis=1)].offset(x1, y1))
+    return [non_max_suppression(Detections.concat(parts), iou_threshold) for parts in per_image]
+
+def rider_class_ids(model, rider_names=("rider",)):
+    """
+    IDs of the classes of a merged vehicle + rider model whose names are rider classes.
+
+    :raises ValueError: If the model has no such class; pass its rider class IDs as rider_classes instead.
+    """
+    names = getattr(model, 'names', None) or {}
+    if isinstance(names, (list, tuple)):
+        names = dict(enumerate(names))
+    rider_classes = [class_id for class_id, name in names.items() if str(name).lower() in rider_names]
+    if not rider_classes:
+        raise ValueError(f"The merged model has no class named {' or '.join(rider_names)} (its classes are "
+                         f"{sorted(names.values(), key=str)}); pass its rider class IDs as rider_classes")
+    return rider_classes
+
+def split_riders(detections, rider_classes):
+    """
+    Splits the Detections of a merged vehicle + rider model into vehicles and riders.
+
+    :param rider_classes: Class IDs of the merged model that are riders.
+    :return: Tuple of (vehicles, riders). Vehicles keep their class IDs, so motorcycles keep the
+             motorcycle class; riders get the rider class of the separate rider model.
+    """
+    is_rider = np.isin(detections.cls, list(rider_classes))
+    riders = detections[is_rider]
+    riders.cls = np.full(len(riders), THRESHOLDS['rider_class'], dtype=detections.cls.dtype)
+    return detections[~is_rider], riders
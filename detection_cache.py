@@ -0,0 +1,207 @@
+"""
+On-disk cache of model detections, to replay the post-detection pipeline without the models.
+
+Every model's detections of a video are stored as a stream: one directory of flat .npy columns
+(xywh, conf, cls) plus the group keys and row offsets, read back memory-mapped. A stream is
+keyed by the video (its size, mtime and sampled content), the model's weights hash, the confidence threshold and the
+detection settings that change the model input (detect_width, tiling, roi, the helmet imgsz). Within a stream,
+groups are keyed by frame index and, for the helmet model, the crop box.
+
+    cache = DetectionCache("cache", "test_2.mp4", {'vehicle': "vehicle.pt", 'rider': "rider.pt", 'helmet': "helmet.pt"})
+    process_video("test_2.mp4", vehicle_model, rider_model, helmet_model, detection_cache=cache)  # Records
+    process_video("test_2.mp4", None, None, None, detection_cache=DetectionCache(..., replay=True))  # Replays
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from detections import Detections
+from detect_objects import THRESHOLDS
+from helmet_detection import crop_box, detect_helmets_batch
+
+COLUMNS = ("keys", "offsets", "xywh", "conf", "cls")
+FULL_FRAME = (0, 0, 0, 0)  # Crop box of detections made on the whole frame
+
+def file_hash(path, chunk_size=1 << 20):
+    """ SHA-256 of a file's content, or of every file of a directory (e.g. an OpenVINO model). """
+    digest = hashlib.sha256()
+    paths = [path]
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    for name in paths:
+        with open(name, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def video_key(path, samples=8, chunk_size=1 << 20):
+    """
+    SHA-256 of a video's size, modification time and a few sampled chunks (head, tail and evenly
+    spaced ones in between), so multi-hour recordings are not read in full just to key the cache.
+    Touching or copying the video without preserving its mtime starts a new cache.
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha256(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(path, "rb") as f:
+        last = max(stat.st_size - chunk_size, 0)
+        for offset in sorted({last * i // max(samples - 1, 1) for i in range(samples)}):
+            f.seek(offset)
+            digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+class DetectionStream:
+    """ Cached detections of one model on one video, grouped by (frame, x1, y1, x2, y2) keys. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = {}
+        self.columns = None
+        self.new = []
+        if os.path.exists(os.path.join(directory, "offsets.npy")):
+            self.columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+            self.index = {tuple(key): i for i, key in enumerate(self.columns["keys"].tolist())}
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def frame_count(self):
+        """ Number of frames up to the last cached one. """
+        return max((key[0] for key in self.index), default=-1) + 1
+
+    def get(self, key):
+        """ Cached Detections of a (frame, x1, y1, x2, y2) key, or None on a miss. """
+        i = self.index.get(key)
+        if i is None:
+            return None
+        if isinstance(i, Detections):
+            return i
+        start, end = self.columns["offsets"][i], self.columns["offsets"][i + 1]
+        return Detections(self.columns["xywh"][start:end], self.columns["conf"][start:end], self.columns["cls"][start:end])
+
+    def put(self, key, detections):
+        if key not in self.index:
+            self.index[key] = detections
+            self.new.append(key)
+
+    def close(self):
+        """ Writes the new groups together with the cached ones, replacing the stream directory at once. """
+        if not self.new:
+            return
+        keys = list(self.index)
+        parts = [self.get(key) for key in keys]
+        parent = os.path.dirname(self.directory)
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=parent)
+        columns = {
+            'keys': np.array(keys, np.int64).reshape(-1, 5),
+            'offsets': np.concatenate([[0], np.cumsum([len(part) for part in parts])]).astype(np.int64),
+            'xywh': np.concatenate([part.xywh for part in parts]).astype(np.float32),
+            'conf': np.concatenate([part.conf for part in parts]).astype(np.float32),
+            'cls': np.concatenate([part.cls for part in parts]).astype(np.int64),
+        }
+        for name, column in columns.items():
+            np.save(os.path.join(staging, f"{name}.npy"), column)
+
+        # Swap the directories, so a reader never sees half a stream
+        self.columns = None
+        old = None
+        if os.path.exists(self.directory):
+            old = self.directory + ".old"
+            os.replace(self.directory, old)
+        os.replace(staging, self.directory)
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+        self.new = []
+
+class DetectionCache:
+    """
+    Read-through detection cache for process_video.
+
+    Recording runs the models only on frames and helmet crops that are not cached yet, and saves
+    their detections on close. Replay never runs the vehicle and rider models; helmet crops that
+    changed (e.g. after tuning the rider assignment) are detected with the helmet model if one is
+    passed, otherwise they count as not checked for helmets.
+    """
+
+    def __init__(self, directory, video_path, weights, replay=False):
+        """
+        :param directory: Root directory of the cache, shared by all videos.
+        :param video_path: The video whose detections are cached.
+        :param weights: Dict with the 'vehicle', 'rider' and 'helmet' weights paths; rider is None
+                        for a merged vehicle + rider model.
+        :param replay: Read the vehicle and rider detections from the cache only.
+        """
+        self.directory = os.path.join(directory, video_key(video_path)[:16])
+        self.weights = {name: file_hash(path)[:16] for name, path in weights.items() if path}
+        self.merged = not weights.get('rider')
+        self.replay = replay
+        self.streams = {}
+        self.helmet_misses = 0
+
+    def open(self, detect_width=None, tiling=None, roi=None, rider_classes=None, helmet_imgsz=640):
+        """ Opens the streams for the given detection settings and the current confidence threshold. """
+        settings = json.dumps({
+            'detect_width': detect_width, 'tiling': tiling, 'rider_classes': rider_classes,
+            'roi': None if roi is None else [polygon.tolist() for polygon in roi.polygons] + [roi.pad],
+        }, sort_keys=True)
+        settings = hashlib.sha256(settings.encode()).hexdigest()[:8]
+        conf = f"conf{THRESHOLDS['conf']:g}"
+
+        frame_model = 'vehicle' if self.merged else None
+        for name in ("vehicle", "rider"):
+            weights = self.weights.get(frame_model or name)
+            if weights is None:
+                raise ValueError(f"The detection cache needs the {frame_model or name} weights")
+            self.streams[name] = DetectionStream(os.path.join(self.directory, f"{name}_{weights}_{conf}_{settings}"))
+        # Helmet crops come from the full-resolution frame, whatever the detection settings
+        if 'helmet' in self.weights:
+            self.streams['helmet'] = DetectionStream(
+                os.path.join(self.directory, f"helmet_{self.weights['helmet']}_{conf}_imgsz{helmet_imgsz}"))
+        if self.replay and not self.streams['vehicle'].index:
+            raise ValueError(f"Nothing to replay: no cached detections in {self.streams['vehicle'].directory}")
+
+    def frame_count(self):
+        return self.streams['vehicle'].frame_count()
+
+    def has_frames(self, frame_indices):
+        return all((index,) + FULL_FRAME in self.streams[name] for index in frame_indices for name in ("vehicle", "rider"))
+
+    def frames(self, frame_indices):
+        """ Cached (vehicles_batch, riders_batch) of frames; raises ValueError on a miss. """
+        batches = []
+        for name in ("vehicle", "rider"):
+            batch = [self.streams[name].get((index,) + FULL_FRAME) for index in frame_indices]
+            if any(detections is None for detections in batch):
+                raise ValueError(f"No cached {name} detections for frame {frame_indices[batch.index(None)]}; "
+                                 f"record the video with the same settings first")
+            batches.append(batch)
+        return batches[0], batches[1]
+
+    def put_frames(self, frame_indices, vehicles_batch, riders_batch):
+        for index, vehicles, riders in zip(frame_indices, vehicles_batch, riders_batch):
+            self.streams['vehicle'].put((index,) + FULL_FRAME, vehicles)
+            self.streams['rider'].put((index,) + FULL_FRAME, riders)
+
+    def helmets(self, frame_index, frame, helmet_model, trapeziums, envelopes, imgsz=640):
+        """ Helmet Detections of every trapezium, from the cache where its crop box was seen before. """
+        stream = self.streams.get('helmet')
+        keys = [(frame_index,) + crop_box(frame.shape, envelope) for envelope in envelopes]
+        results = [stream.get(key) if stream is not None else None for key in keys]
+        misses = [i for i, detections in enumerate(results) if detections is None]
+        if misses and helmet_model is not None:
+            found = detect_helmets_batch(frame, helmet_model, [trapeziums[i] for i in misses], imgsz, envelopes[misses])
+            for i, detections in zip(misses, found):
+                results[i] = detections
+                if stream is not None:
+                    stream.put(keys[i], detections)
+        elif misses:
+            self.helmet_misses += len(misses)
+            for i in misses:
+                results[i] = Detections()
+        return results
+
+    def close(self):
+        for stream in self.streams.values():
+            stream.close()
@@ -0,0 +1,103 @@
+import cv2
+import numpy as np
+from tracking import track_uncertainty, match_trapezium_tracks
+
+def _thumbnail(frame, width=64):
+    """ Small grayscale copy of a frame, cheap enough to diff every frame. """
+    h, w = frame.shape[:2]
+    small = cv2.resize(frame, (width, max(1, int(h * width / w))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+class DetectionStride:
+    """
+    Decides which frames get full detection and carries trapeziums across the frames in between.
+
+    Full detection runs every stride frames, or sooner when the scene has changed by more than
+    motion_threshold (mean absolute difference of small grayscale frames, 0-1) since the last
+    detection, or when a confirmed track's Kalman uncertainty exceeds uncertainty_threshold.
+    """
+
+    def __init__(self, stride, motion_threshold=0.04, uncertainty_threshold=0.5):
+        self.stride = stride
+        self.motion_threshold = motion_threshold
+        self.uncertainty_threshold = uncertainty_threshold
+        self.frames_since_detection = None
+        self.reference = None
+        self.trapeziums = {}  # track_id -> (points, ltrb, triple_riding, counts)
+        self.track_ids = []  # Track ID of every trapezium of the last propagated frame
+        self.counts = []  # (riders, helmets, no_helmets) of every trapezium of the last propagated frame
+        self.detections = 0
+        self.propagated = 0
+
+    def should_detect(self, frame, tracks):
+        """ Whether the current frame needs full detection. """
+        if self.frames_since_detection is None or self.frames_since_detection + 1 >= self.stride:
+            return True
+
+        if self.motion_threshold is not None:
+            motion = np.mean(cv2.absdiff(_thumbnail(frame), self.reference)) / 255
+            if motion > self.motion_threshold:
+                return True
+
+        if self.uncertainty_threshold is not None:
+            for track in tracks:
+                if track.is_confirmed() and track_uncertainty(track) > self.uncertainty_threshold:
+                    return True
+
+        return False
+
+    def remember(self, frame, tracks, trapeziums, triple_riding_detections, counts=None):
+        """
+        Record a detected frame and link its trapeziums to the trapezium tracks that matched them.
+
+        :param counts: Optional (riders, helmets, no_helmets) tuple per trapezium, carried along with it.
+        """
+        self.frames_since_detection = 0
+        self.reference = _thumbnail(frame)
+        self.detections += 1
+        self.trapeziums = {}
+
+        triple_ids = {id(t) for t in triple_riding_detections}
+        for track, best in match_trapezium_tracks(tracks, trapeziums):
+            trapezium = trapeziums[best]
+            self.trapeziums[track.track_id] = (
+                np.asarray(trapezium, np.float32),
+                np.asarray(track.to_ltrb(), np.float32),
+                id(trapezium) in triple_ids,
+                counts[best] if counts is not None else None,
+            )
+
+    def propagate(self, tracks):
+        """
+        Move the remembered trapeziums with their tracks' predicted boxes.
+
+        :return: Tuple of (trapeziums, triple_riding_detections) for the current frame.
+        """
+        self.frames_since_detection += 1
+        self.propagated += 1
+        trapeziums = []
+        triple_riding_detections = []
+        self.track_ids = []
+        self.counts = []
+        alive = {}
+
+        for track in tracks:
+            if track.track_id not in self.trapeziums or not track.is_confirmed():
+                continue
+            points, old_ltrb, triple_riding, counts = self.trapeziums[track.track_id]
+            alive[track.track_id] = self.trapeziums[track.track_id]
+
+            new_ltrb = np.asarray(track.to_ltrb(), np.float32)
+            old_center, new_center = (old_ltrb[:2] + old_ltrb[2:]) / 2, (new_ltrb[:2] + new_ltrb[2:]) / 2
+            scale = (new_ltrb[2:] - new_ltrb[:2]) / np.maximum(old_ltrb[2:] - old_ltrb[:2], 1e-6)
+            trapezium = ((points - old_center) * scale + new_center).tolist()
+
+            trapeziums.append(trapezium)
+            self.track_ids.append(track.track_id)
+            self.counts.append(counts)
+            if triple_riding:
+                triple_riding_detections.append(trapezium)
+
+        # Forget trapeziums whose track the tracker has dropped
+        self.trapeziums = alive
+        return trapeziums, triple_riding_detections
@@ -0,0 +1,110 @@
+import numpy as np
+
+class Detections:
+    """
+    Detections of one image stored as contiguous NumPy arrays.
+
+    xywh holds (x_center, y_center, w, h) rows, conf the scores and cls the class of every box.
+    Indexing with an int returns the old {'x', 'y', 'w', 'h', 'class'} dict so code written for
+    lists of dicts keeps working; indexing with a slice, mask or index array returns Detections.
+    """
+    __slots__ = ('xywh', 'conf', 'cls')
+
+    def __init__(self, xywh=None, conf=None, cls=None):
+        self.xywh = np.zeros((0, 4), np.float32) if xywh is None else np.ascontiguousarray(xywh, np.float32).reshape(-1, 4)
+        n = len(self.xywh)
+        self.conf = np.ones(n, np.float32) if conf is None else np.asarray(conf, np.float32).reshape(n)
+        self.cls = np.zeros(n, np.int64) if cls is None else np.asarray(cls).reshape(n)
+
+    @classmethod
+    def _wrap(cls, xywh, conf, classes):
+        """ Builds Detections from arrays that are already validated, without copying. """
+        detections = cls.__new__(cls)
+        detections.xywh, detections.conf, detections.cls = xywh, conf, classes
+        return detections
+
+    @classmethod
+    def from_result(cls, result):
+        """ Builds Detections from one ultralytics result with a single device-to-host copy. """
+        # boxes.data rows are (x1, y1, x2, y2, [track_id,] conf, cls)
+        data = result.boxes.data.cpu().numpy()
+        x1, y1, x2, y2 = data[:, 0], data[:, 1], data[:, 2], data[:, 3]
+        xywh = np.stack([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], axis=1)
+        return cls(xywh, data[:, -2], data[:, -1].astype(np.int64))
+
+    @classmethod
+    def from_dicts(cls, detections):
+        """ Builds Detections from a list of {'x', 'y', 'w', 'h', 'class'} dicts. """
+        if not detections:
+            return cls()
+        xywh = [[d['x'], d['y'], d['w'], d['h']] for d in detections]
+        conf = [d.get('conf', 1.0) for d in detections]
+        classes = [d['class'] for d in detections]
+        if not all(isinstance(c, (int, np.integer)) for c in classes):
+            classes = np.array(classes, dtype=object)
+        return cls(xywh, conf, classes)
+
+    @classmethod
+    def concat(cls, detections_list):
+        """ Concatenates several Detections (or lists of dicts) into one. """
+        parts = [as_detections(d) for d in detections_list]
+        parts = [d for d in parts if len(d)] or [cls()]
+        mixed = any(d.cls.dtype == object for d in parts)
+        return cls(
+            np.concatenate([d.xywh for d in parts]),
+            np.concatenate([d.conf for d in parts]),
+            np.concatenate([d.cls.astype(object) if mixed else d.cls for d in parts]),
+        )
+
+    def __len__(self):
+        return len(self.xywh)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            x, y, w, h = self.xywh[index]
+            class_id = self.cls[index]
+            if isinstance(class_id, np.integer):
+                class_id = int(class_id)
+            return {'x': x, 'y': y, 'w': w, 'h': h, 'class': class_id}
+        return Detections._wrap(self.xywh[index], self.conf[index], self.cls[index])
+
+    def __repr__(self):
+        return f"Detections(n={len(self)})"
+
+    @property
+    def xyxy(self):
+        """ Boxes as (x1, y1, x2, y2) rows. """
+        xy, wh = self.xywh[:, :2], self.xywh[:, 2:]
+        return np.concatenate([xy - wh / 2, xy + wh / 2], axis=1)
+
+    @property
+    def ltwh(self):
+        """ Boxes as (left, top, w, h) rows, the format DeepSORT expects. """
+        ltwh = self.xywh.copy()
+        ltwh[:, :2] -= ltwh[:, 2:] / 2
+        return ltwh
+
+    def offset(self, dx, dy):
+        """ Returns the detections shifted by (dx, dy), e.g. from crop to full-frame coordinates. """
+        xywh = self.xywh.copy()
+        xywh[:, 0] += dx
+        xywh[:, 1] += dy
+        return Detections._wrap(xywh, self.conf, self.cls)
+
+    def scale(self, factor):
+        """ Returns the detections with positions and sizes multiplied by factor. """
+        return Detections._wrap((self.xywh * factor).astype(np.float32), self.conf, self.cls)
+
+    def to_dicts(self):
+        """ Returns the detections as a list of {'x', 'y', 'w', 'h', 'class'} dicts. """
+        return list(self)
+
+def as_detections(detections):
+    """ Accepts Detections or a list of detection dicts and returns Detections. """
+    if isinstance(detections, Detections):
+        return detections
+    return Detections.from_dicts(list(detections))
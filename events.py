@@ -0,0 +1,130 @@
+import json
+from tracking import match_trapezium_tracks
+
+HELMET_CLASSES = ('Helmet', 'No_Helmet')  # Helmet model class IDs 0 and 1
+
+# Every event has all fields; fields that do not apply to its type are None
+EVENT_FIELDS = ('type', 'frame', 'timestamp', 'track_id', 'class', 'ltrb',
+                'trapezium', 'riders', 'helmets', 'no_helmets', 'triple_riding')
+
+def helmet_counts(helmets):
+    """ Number of (helmet, no-helmet) detections among a trapezium's helmet Detections. """
+    return int((helmets.cls == 0).sum()), int((helmets.cls == 1).sum())
+
+def _event(**fields):
+    return {name: fields.get(name) for name in EVENT_FIELDS}
+
+def trapezium_event(frame_index, timestamp, track_id, trapezium, counts, triple_riding):
+    """
+    Event for one trapezium (a motorcycle and its riders) in a frame.
+
+    :param counts: (riders, helmets, no_helmets) tuple, or None when unknown.
+    """
+    riders, helmets, no_helmets = counts if counts is not None else (None, None, None)
+    return _event(
+        type='trapezium', frame=frame_index, timestamp=timestamp,
+        track_id=None if track_id is None else str(track_id),
+        trapezium=[[float(x), float(y)] for x, y in trapezium],
+        riders=riders, helmets=helmets, no_helmets=no_helmets,
+        triple_riding=bool(triple_riding),
+    )
+
+def frame_events(frame_index, timestamp, tracks, trapeziums, triple_riding_detections, counts=None, track_ids=None):
+    """
+    Events of one processed frame: one 'track' event per confirmed track and one
+    'trapezium' event per trapezium.
+
+    :param counts: Optional list of (riders, helmets, no_helmets) tuples, one per trapezium.
+    :param track_ids: Optional list of the track ID of every trapezium. By default trapeziums are
+                      matched to the Trapezium tracks updated with them this frame.
+    """
+    events = [
+        _event(type='track', frame=frame_index, timestamp=timestamp, track_id=str(track.track_id),
+               ltrb=[float(v) for v in track.to_ltrb()], **{'class': track.get_det_class()})
+        for track in tracks if track.is_confirmed()
+    ]
+
+    if track_ids is None:
+        track_ids = [None] * len(trapeziums)
+        for track, i in match_trapezium_tracks(tracks, trapeziums):
+            track_ids[i] = track.track_id
+
+    triple_ids = {id(t) for t in triple_riding_detections}
+    for i, trapezium in enumerate(trapeziums):
+        events.append(trapezium_event(
+            frame_index, timestamp, track_ids[i], trapezium,
+            counts[i] if counts is not None else None, id(trapezium) in triple_ids,
+        ))
+    return events
+
+class EventWriter:
+    """
+    Appends events to a JSONL or Parquet file.
+
+    Parquet needs pyarrow; rows are buffered and written one row group at a time.
+    """
+
+    def __init__(self, path, format=None, row_group_size=10000):
+        """
+        :param format: "jsonl" or "parquet". By default taken from the file extension.
+        """
+        self.path = path
+        self.format = format or ('parquet' if str(path).endswith('.parquet') else 'jsonl')
+        self.row_group_size = row_group_size
+        self.count = 0
+
+        if self.format == 'jsonl':
+            self.file = open(path, 'w')
+        elif self.format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self.schema = pa.schema([
+                ('type', pa.string()), ('frame', pa.int64()), ('timestamp', pa.float64()),
+                ('track_id', pa.string()), ('class', pa.string()), ('ltrb', pa.list_(pa.float64())),
+                ('trapezium', pa.list_(pa.list_(pa.float64()))), ('riders', pa.int64()),
+                ('helmets', pa.int64()), ('no_helmets', pa.int64()), ('triple_riding', pa.bool_()),
+            ])
+            self.file = pq.ParquetWriter(path, self.schema)
+            self.rows = []
+        else:
+            raise ValueError(f"Unknown event format: {self.format} (expected 'jsonl' or 'parquet')")
+
+    def write(self, events):
+        """ Appends a list of events. """
+        self.count += len(events)
+        if self.format == 'jsonl':
+            for event in events:
+                self.file.write(json.dumps(event) + '\n')
+            return
+        self.rows.extend(events)
+        if len(self.rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        if self.rows:
+            self.file.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        if self.format == 'parquet':
+            self._flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_events(path):
+    """ Yields the events of a JSONL or Parquet event file, in order. """
+    if str(path).endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+        return
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
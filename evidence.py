@@ -0,0 +1,76 @@
+import os
+from collections import deque
+import cv2
+
+class ClipRecorder:
+    """
+    Writes short annotated clips around violations instead of the whole video.
+
+    The last pre_frames frames are kept in a ring buffer, together with what to draw on them.
+    When a track violates, its clip starts with the buffered frames and runs until post_frames
+    frames after the track's last violation. Memory stays bounded by the buffer size no matter
+    how long the stream runs; frames are only drawn and encoded when they end up in a clip.
+    """
+
+    def __init__(self, output_dir, fps, frame_size, pre_frames=50, post_frames=50, draw=None):
+        """
+        :param output_dir: Directory the clips are written to.
+        :param frame_size: (width, height) of the frames.
+        :param draw: Optional function (frame, boxes, triple_riding_detections) -> frame that
+                     annotates a frame just before it is encoded.
+        """
+        self.output_dir = output_dir
+        self.fps = fps
+        self.frame_size = frame_size
+        self.post_frames = post_frames
+        self.draw = draw
+        self.buffer = deque(maxlen=pre_frames)
+        self.active = {}  # track_id -> [writer, frames left]
+        self.clips = []
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _render(self, item):
+        frame, boxes, triple_riding_detections = item
+        if self.draw is None:
+            return frame
+        return self.draw(frame.copy(), boxes, triple_riding_detections)
+
+    def add(self, frame_index, frame, boxes, triple_riding_detections, violating_track_ids):
+        """
+        Adds a frame and starts or extends the clips of the tracks violating in it.
+
+        :param boxes: (ltrb, class_name) boxes drawn onto the frame.
+        :param violating_track_ids: IDs of the tracks with a violation in this frame.
+        """
+        item = (frame, boxes, triple_riding_detections)
+        rendered = None
+
+        for track_id in violating_track_ids:
+            if track_id in self.active:
+                self.active[track_id][1] = self.post_frames + 1
+                continue
+            path = os.path.join(self.output_dir, f"track_{track_id}_frame_{frame_index}.mp4")
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, self.frame_size)
+            for buffered in self.buffer:
+                writer.write(self._render(buffered))
+            self.active[track_id] = [writer, self.post_frames + 1]
+            self.clips.append(path)
+
+        for track_id in list(self.active):
+            writer, left = self.active[track_id]
+            if rendered is None:
+                rendered = self._render(item)
+            writer.write(rendered)
+            if left <= 1:
+                writer.release()
+                del self.active[track_id]
+            else:
+                self.active[track_id][1] = left - 1
+
+        self.buffer.append(item)
+
+    def close(self):
+        """ Finishes all clips still being written. """
+        for writer, _ in self.active.values():
+            writer.release()
+        self.active = {}
@@ -0,0 +1,63 @@
+import numpy as np
+
+class FeatureEmbedder:
+    """
+    Reuses a YOLO detector's feature maps as appearance embeddings for DeepSORT.
+
+    A forward pre-hook on the detection head keeps the feature maps of the last model call.
+    embed() then ROI-aligns any boxes of an image in that call onto one pyramid level and
+    returns one L2-normalised vector per box, so DeepSORT can run without its own embedder
+    network. Only PyTorch (.pt) models expose their feature maps.
+    """
+
+    def __init__(self, model, level=0, output_size=2):
+        """
+        :param model: ultralytics YOLO model whose features are reused.
+        :param level: Pyramid level fed to the head (0 = stride 8, 1 = stride 16, 2 = stride 32).
+        :param output_size: ROI-align output is output_size x output_size per channel.
+        """
+        self.level = level
+        self.output_size = output_size
+        self.features = None
+
+        head = model.model.model[-1]
+        self.stride = int(head.stride[level])
+        self._hook = head.register_forward_pre_hook(self._capture)
+
+    def _capture(self, module, inputs):
+        self.features = inputs[0][self.level].detach()
+
+    def embed(self, index, xyxy, image_shape):
+        """
+        Embeds boxes of one image from the last model call.
+
+        :param index: Position of the image in the last batch passed to the model.
+        :param xyxy: (N, 4) array of (x1, y1, x2, y2) boxes in original image coordinates.
+        :param image_shape: Shape of the original image.
+        :return: (N, D) float32 array of L2-normalised embeddings.
+        """
+        import torch
+        from torchvision.ops import roi_align
+
+        xyxy = np.asarray(xyxy, np.float32).reshape(-1, 4)
+        if self.features is None or not len(xyxy):
+            return np.zeros((len(xyxy), 0), np.float32)
+
+        # Undo the predictor's letterbox: scale to the network input, then centre the padding
+        feature_map = self.features[index:index + 1].float()
+        input_h, input_w = feature_map.shape[2] * self.stride, feature_map.shape[3] * self.stride
+        h, w = image_shape[:2]
+        scale = min(input_h / h, input_w / w)
+        pad_x, pad_y = (input_w - w * scale) / 2, (input_h - h * scale) / 2
+        boxes = xyxy * scale + [pad_x, pad_y, pad_x, pad_y]
+
+        rois = torch.from_numpy(boxes).to(feature_map.device)
+        pooled = roi_align(feature_map, [rois], output_size=self.output_size,
+                           spatial_scale=1 / self.stride, aligned=True)
+        embeddings = pooled.flatten(1)
+        embeddings = embeddings / embeddings.norm(dim=1, keepdim=True).clamp(min=1e-12)
+        return embeddings.cpu().numpy()
+
+    def close(self):
+        """ Removes the forward hook from the model. """
+        self._hook.remove()
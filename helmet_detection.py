@@ -1,5 +1,8 @@
 import cv2
-from detect_objects import detect_objects
+from detect_objects import detect_objects, detect_objects_batch
+from detections import Detections
+from profiling import stage
+from trapezium import trapezium_envelopes
 import numpy as np
 
 def detect_helmets(frame, helmet_model, trapezium):
@@ -9,138 +12,128 @@ def detect_helmets(frame, helmet_model, trapezium):
     :param frame: The current frame from the video.
     :param helmet_model: The YOLO model for helmet detection.
     :param trapezium: List of four (x, y) points defining the trapezium.
-    :return: List of detected helmet and no-helmet bounding boxes in full-frame format.
+    :return: Detections of helmet and no-helmet bounding boxes in full-frame format.
     """
-    x_min = min(p[0] for p in trapezium)
-    y_min = min(p[1] for p in trapezium)
-    x_max = max(p[0] for p in trapezium)
-    y_max = max(p[1] for p in trapezium)
+    # Crop the trapezium region as a view of the frame
+    crop = crop_trapezium(frame, trapezium)
     
-    # Define center and size for getRectSubPix
-    center = ((x_min + x_max) / 2, (y_min + y_max) / 2)
-    size = (x_max - x_min, y_max - y_min)
-    
-    # Crop the trapezium region using getRectSubPix
-    roi = cv2.getRectSubPix(frame, (int(size[0]), int(size[1])), center)
-    
-    if roi is None or roi.size == 0:
-        return []
+    if crop is None:
+        return Detections()
+    roi, x_min, y_min = crop
     
     # Run YOLO helmet detection on cropped region
     detections = detect_objects(helmet_model, roi)
     
     # Convert coordinates to full-frame reference
-    full_frame_detections = []
-    for det in detections:
-        x_center=det['x']
-        y_center=det['y']
-        w=det['w']
-        h=det['h']
-        class_id=det['class']
-        # Convert (x_center, y_center) in ROI to full-frame
-        full_x_center = x_center + x_min
-        full_y_center = y_center + y_min
-        
-        # Append bounding box in full-frame format
-        full_frame_detections.append({
-            'x': full_x_center,
-            'y': full_y_center,
-            'w': w,
-            'h': h,
-            'class': class_id
-        })
-    
-    return full_frame_detections
+    return detections.offset(x_min, y_min)
 
+def letterbox(image, size=640, pad_value=114, scaleup=True):
+    """
+    Resizes an image to fit a size x size square (or a (width, height) size), keeping its aspect
+    ratio, and pads the rest.
 
+    :param scaleup: Also enlarge images smaller than the size; otherwise they are only padded.
+    :return: Tuple of (padded image, scale, (pad_x, pad_y)).
+    """
+    width, height = (size, size) if np.isscalar(size) else size
+    h, w = image.shape[:2]
+    scale = min(width / w, height / h)
+    if not scaleup:
+        scale = min(scale, 1.0)
+    new_w, new_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    resized = image
+    if (new_w, new_h) != (w, h):
+        resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    pad_x = (width - new_w) // 2
+    pad_y = (height - new_h) // 2
+    padded = np.full((height, width) + image.shape[2:], pad_value, dtype=image.dtype)
+    padded[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+    return padded, scale, (pad_x, pad_y)
+
+def batch_size_of(shapes, imgsz=640, stride=32):
+    """
+    The (width, height) every image of a batch is letterboxed to: the largest image, once images
+    larger than imgsz are scaled down to fit it, rounded up to a multiple of the model stride.
+    """
+    scales = [min(1.0, imgsz / max(shape[:2])) for shape in shapes]
+    w = int(np.ceil(max(shape[1] * scale for shape, scale in zip(shapes, scales))))
+    h = int(np.ceil(max(shape[0] * scale for shape, scale in zip(shapes, scales))))
+    return (min(imgsz, -(-w // stride) * stride), min(imgsz, -(-h // stride) * stride))
+
+def crop_box(frame_shape, envelope):
+    """ The (x1, y1, x2, y2) integer pixel box crop_envelope cuts for an envelope. """
+    h, w = frame_shape[:2]
+    return (min(max(int(np.floor(envelope[0])), 0), w), min(max(int(np.floor(envelope[1])), 0), h),
+            min(max(int(np.ceil(envelope[2])), 0), w), min(max(int(np.ceil(envelope[3])), 0), h))
+
+def crop_envelope(frame, envelope):
+    """
+    Crops an (x1, y1, x2, y2) envelope out of the frame without copying.
 
+    The envelope is widened to whole pixels and clipped to the frame, so the crop is always a
+    NumPy view of the frame rather than an interpolated copy.
 
-# import cv2
-# from detect_objects import detect_objects
-# import numpy as np
+    :return: Tuple of (roi, x_min, y_min), or None if the envelope is empty.
+    """
+    x_min, y_min, x_max, y_max = crop_box(frame.shape, envelope)
+    if x_max <= x_min or y_max <= y_min:
+        return None
+    return frame[y_min:y_max, x_min:x_max], x_min, y_min
 
-# def detect_helmets(frame, helmet_model, trapezium):
-#     """
-#     Detects helmets within the given trapezium bounding box.
-    
-#     :param frame: The current frame from the video.
-#     :param helmet_model: The YOLO model for helmet detection.
-#     :param trapezium: List of four (x, y) points defining the trapezium.
-#     :return: List of detected helmet and no-helmet bounding boxes inside the trapezium.
-#     """
-#     x_min = min(p[0] for p in trapezium)
-#     y_min = min(p[1] for p in trapezium)
-#     x_max = max(p[0] for p in trapezium)
-#     y_max = max(p[1] for p in trapezium)
-    
-#     # Define center and size for getRectSubPix
-#     center = ((x_min + x_max) / 2, (y_min + y_max) / 2)
-#     size = (x_max - x_min, y_max - y_min)
-    
-#     # Crop the trapezium region using getRectSubPix
-#     roi = cv2.getRectSubPix(frame, (int(size[0]), int(size[1])), center)
-#     names = ['Helmet', 'No_Helmet']
-    
-#     if roi is None or roi.size == 0:
-#         return []
-    
-#     detections = detect_objects(helmet_model, roi)
-#     return detections
-
-
-# import cv2
-# from detect_objects import detect_objects
-# import numpy as np
-
-# def detect_helmets(frame, helmet_model, trapezium):
-#     """
-#     Detects helmets within the given trapezium bounding box.
-
-#     :param frame: The current frame from the video.
-#     :param helmet_model: The YOLO model for helmet detection.
-#     :param trapezium: List of four (x, y) points defining the trapezium.
-#     :return: List of detected helmet and no-helmet bounding boxes inside the trapezium.
-#     """
-#     # Convert trapezium to numpy array if not already
-#     if not isinstance(trapezium, np.ndarray):
-#         trapezium = np.array(trapezium)
-#     # Validate the trapezium
-#     if trapezium is None or trapezium.shape != (4, 2):
-#         return []
-#     exit()
-
-#     # Create a mask for the trapezium
-#     mask = np.zeros(frame.shape[:2], dtype=np.uint8)
-#     cv2.fillPoly(mask, [trapezium], 255)
-
-#     # Apply the mask to the frame
-#     masked_frame = cv2.bitwise_and(frame, frame, mask=mask)
-
-#     # Find the bounding box around the trapezium
-#     x_min, y_min = np.min(trapezium, axis=0)
-#     x_max, y_max = np.max(trapezium, axis=0)
-
-#     # Ensure the bounding box is within the frame size
-#     x_min, x_max = max(0, x_min), min(frame.shape[1], x_max)
-#     y_min, y_max = max(0, y_min), min(frame.shape[0], y_max)
-
-#     # Crop the region of interest (ROI) within the trapezium
-#     roi = masked_frame[y_min:y_max, x_min:x_max]
-
-#     # Return empty if the ROI is invalid
-#     if roi.size == 0:
-#         return []
-
-#     # Detect helmets within the cropped trapezium region
-#     detections = detect_objects(helmet_model, roi)
-
-#     # Adjust bounding box coordinates to the original frame
-#     adjusted_detections = []
-#     for det in detections:
-#         x1, y1, x2, y2 = det['bbox']
-#         adjusted_detections.append({
-#             'class': det['class'],
-#             'bbox': [x1 + x_min, y1 + y_min, x2 + x_min, y2 + y_min]
-#         })
-
-#     return adjusted_detections
+def crop_trapezium(frame, trapezium):
+    """
+    Crops the envelope of a trapezium out of the frame, as a view.
+
+    :return: Tuple of (roi, x_min, y_min), or None if the envelope is empty.
+    """
+    return crop_envelope(frame, trapezium_envelopes([trapezium])[0])
+
+def detect_helmets_batch(frame, helmet_model, trapeziums, imgsz=640, envelopes=None, stride=32):
+    """
+    Detects helmets inside every trapezium of a frame with a single helmet model call.
+
+    Each trapezium region is cropped and letterboxed to the size of the batch's largest crop,
+    rounded up to the model stride, and the batch runs at that input size. Crops are never
+    enlarged; only crops larger than imgsz are scaled down. Results are mapped back to
+    full-frame coordinates.
+
+    :param frame: The current frame from the video.
+    :param helmet_model: The YOLO model for helmet detection.
+    :param trapeziums: List of trapeziums, each a list of (x, y) points.
+    :param imgsz: The helmet model's input size, the largest side a batch runs at.
+    :param envelopes: Optional (N, 4) envelopes of the trapeziums, e.g. from build_trapeziums.
+    :param stride: The helmet model's stride; the batch input size is a multiple of it.
+    :return: One Detections of full-frame helmets per trapezium, in the same order.
+    """
+    full_frame_detections = [Detections() for _ in trapeziums]
+    rois = []
+    crops = []
+    crop_info = []
+
+    with stage("helmet_crop"):
+        if envelopes is None:
+            envelopes = trapezium_envelopes(trapeziums)
+        for i, envelope in enumerate(envelopes):
+            crop = crop_envelope(frame, envelope)
+            if crop is not None:
+                rois.append((i,) + crop)
+
+        if rois:
+            size = batch_size_of([roi.shape for _, roi, _, _ in rois], imgsz, stride)
+            for i, roi, x_min, y_min in rois:
+                padded, scale, pad = letterbox(roi, size, scaleup=False)
+                crops.append(padded)
+                crop_info.append((i, x_min, y_min, scale, pad))
+
+    if crops:
+        with stage("helmet_model"):
+            batch_detections = detect_objects_batch(helmet_model, crops, (size[1], size[0]))
+    else:
+        batch_detections = []
+
+    for (i, x_min, y_min, scale, (pad_x, pad_y)), detections in zip(crop_info, batch_detections):
+        # Undo the letterbox, then convert from ROI to full-frame coordinates
+        full_frame_detections[i] = detections.offset(-pad_x, -pad_y).scale(1 / scale).offset(x_min, y_min)
+
+    return full_frame_detections
@@ -0,0 +1,198 @@
+import numpy as np
+from utils import iou_matrix
+
+class KalmanBoxFilter:
+    """
+    Constant-velocity Kalman filter on (x_center, y_center, aspect ratio, height), as in DeepSORT.
+    """
+    std_weight_position = 1. / 20
+    std_weight_velocity = 1. / 160
+
+    def __init__(self):
+        self.motion = np.eye(8)
+        self.motion[:4, 4:] = np.eye(4)
+        self.observation = np.eye(4, 8)
+
+    def initiate(self, measurement):
+        mean = np.r_[measurement, np.zeros(4)]
+        h = measurement[3]
+        std = [
+            2 * self.std_weight_position * h, 2 * self.std_weight_position * h, 1e-2, 2 * self.std_weight_position * h,
+            10 * self.std_weight_velocity * h, 10 * self.std_weight_velocity * h, 1e-5, 10 * self.std_weight_velocity * h,
+        ]
+        return mean, np.diag(np.square(std))
+
+    def predict(self, mean, covariance):
+        h = mean[3]
+        std = [
+            self.std_weight_position * h, self.std_weight_position * h, 1e-2, self.std_weight_position * h,
+            self.std_weight_velocity * h, self.std_weight_velocity * h, 1e-5, self.std_weight_velocity * h,
+        ]
+        mean = self.motion @ mean
+        covariance = self.motion @ covariance @ self.motion.T + np.diag(np.square(std))
+        return mean, covariance
+
+    def update(self, mean, covariance, measurement):
+        h = mean[3]
+        std = [self.std_weight_position * h, self.std_weight_position * h, 1e-1, self.std_weight_position * h]
+        projected_mean = self.observation @ mean
+        projected_cov = self.observation @ covariance @ self.observation.T + np.diag(np.square(std))
+
+        kalman_gain = np.linalg.solve(projected_cov, self.observation @ covariance).T
+        mean = mean + kalman_gain @ (measurement - projected_mean)
+        covariance = covariance - kalman_gain @ projected_cov @ kalman_gain.T
+        return mean, covariance
+
+def _ltwh_to_xyah(ltwh):
+    l, t, w, h = ltwh
+    return np.array([l + w / 2, t + h / 2, w / max(h, 1e-6), h], np.float64)
+
+class Track:
+    """ A motion-only track exposing the same interface as deep_sort_realtime's Track. """
+    TENTATIVE, CONFIRMED, DELETED = 1, 2, 3
+
+    def __init__(self, track_id, mean, covariance, n_init, ltwh, det_class, det_conf):
+        self.track_id = str(track_id)
+        self.mean = mean
+        self.covariance = covariance
+        self.hits = 1
+        self.age = 1
+        self.time_since_update = 0
+        self.state = Track.TENTATIVE if n_init > 1 else Track.CONFIRMED
+        self.original_ltwh = np.asarray(ltwh, np.float64)
+        self.det_class = det_class
+        self.det_conf = det_conf
+
+    def to_ltwh(self, orig=False):
+        if orig and self.time_since_update == 0:
+            return self.original_ltwh.copy()
+        x, y, a, h = self.mean[:4]
+        w = a * h
+        return np.array([x - w / 2, y - h / 2, w, h])
+
+    def to_ltrb(self, orig=False):
+        ltwh = self.to_ltwh(orig)
+        ltwh[2:] += ltwh[:2]
+        return ltwh
+
+    def get_det_class(self):
+        return self.det_class
+
+    def get_det_conf(self):
+        return self.det_conf
+
+    def is_tentative(self):
+        return self.state == Track.TENTATIVE
+
+    def is_confirmed(self):
+        return self.state == Track.CONFIRMED
+
+    def is_deleted(self):
+        return self.state == Track.DELETED
+
+class IoUTracker:
+    """
+    Appearance-free tracker: Kalman prediction plus ByteTrack-style IoU association.
+
+    Detections at or above high_threshold confidence are matched to all tracks first; the
+    remaining low-confidence detections can then only extend confirmed tracks, never start new
+    ones. Matching is greedy by IoU and only pairs detections and tracks of the same class.
+    update_tracks takes and returns the same formats as deep_sort_realtime's DeepSort.
+    """
+
+    def __init__(self, max_age=30, n_init=3, iou_threshold=0.3, high_threshold=0.5):
+        self.max_age = max_age
+        self.n_init = n_init
+        self.iou_threshold = iou_threshold
+        self.high_threshold = high_threshold
+        self.kf = KalmanBoxFilter()
+        self.tracks = []
+        self._next_id = 1
+
+    def update_tracks(self, raw_detections, frame=None, embeds=None, others=None):
+        """
+        :param raw_detections: List of ([left, top, w, h], confidence, class) tuples.
+        :return: All current tracks, confirmed and tentative.
+        """
+        self.predict_tracks()
+
+        boxes = np.array([d[0] for d in raw_detections], np.float64).reshape(-1, 4)
+        confs = np.array([d[1] for d in raw_detections], np.float64)
+        classes = [d[2] for d in raw_detections]
+
+        high = [i for i in range(len(raw_detections)) if confs[i] >= self.high_threshold]
+        low = [i for i in range(len(raw_detections)) if confs[i] < self.high_threshold]
+
+        unmatched_tracks = list(range(len(self.tracks)))
+        matches, unmatched_tracks, unmatched_high = self._match(boxes, classes, high, unmatched_tracks)
+        confirmed_left = [t for t in unmatched_tracks if self.tracks[t].is_confirmed()]
+        low_matches, _, _ = self._match(boxes, classes, low, confirmed_left)
+
+        for t, d in matches + low_matches:
+            self._update(self.tracks[t], boxes[d], classes[d], confs[d])
+
+        for track in self.tracks:
+            if track.time_since_update > 0:
+                if track.is_tentative() or track.time_since_update > self.max_age:
+                    track.state = Track.DELETED
+
+        for d in unmatched_high:
+            mean, covariance = self.kf.initiate(_ltwh_to_xyah(boxes[d]))
+            self.tracks.append(Track(self._next_id, mean, covariance, self.n_init, boxes[d], classes[d], confs[d]))
+            self._next_id += 1
+
+        self.tracks = [track for track in self.tracks if not track.is_deleted()]
+        return self.tracks
+
+    def predict_tracks(self):
+        """
+        Advances every track by one frame on its motion model, like DeepSORT's Tracker.predict.
+
+        Without an update this is not a miss: tentative tracks are not deleted.
+
+        :return: All current tracks.
+        """
+        for track in self.tracks:
+            track.mean, track.covariance = self.kf.predict(track.mean, track.covariance)
+            track.age += 1
+            track.time_since_update += 1
+        return self.tracks
+
+    def _update(self, track, ltwh, det_class, det_conf):
+        track.mean, track.covariance = self.kf.update(track.mean, track.covariance, _ltwh_to_xyah(ltwh))
+        track.original_ltwh = np.asarray(ltwh, np.float64)
+        track.det_class = det_class
+        track.det_conf = det_conf
+        track.hits += 1
+        track.time_since_update = 0
+        if track.is_tentative() and track.hits >= self.n_init:
+            track.state = Track.CONFIRMED
+
+    def _match(self, boxes, classes, detection_indices, track_indices):
+        """ Greedy IoU matching; returns (matches, unmatched_tracks, unmatched_detections). """
+        if not detection_indices or not track_indices:
+            return [], list(track_indices), list(detection_indices)
+
+        det_boxes = boxes[detection_indices].copy()
+        det_boxes[:, 2:] += det_boxes[:, :2]
+        track_boxes = np.array([self.tracks[t].to_ltrb() for t in track_indices])
+        ious = iou_matrix(track_boxes, det_boxes)
+
+        # Only pair detections and tracks of the same class
+        same_class = np.array([[self.tracks[t].det_class == classes[d] for d in detection_indices] for t in track_indices])
+        ious[~same_class] = 0
+
+        matches = []
+        used_tracks, used_dets = set(), set()
+        rows, cols = np.nonzero(ious > self.iou_threshold)
+        for k in np.argsort(-ious[rows, cols], kind="stable"):
+            r, c = rows[k], cols[k]
+            if r in used_tracks or c in used_dets:
+                continue
+            used_tracks.add(r)
+            used_dets.add(c)
+            matches.append((track_indices[r], detection_indices[c]))
+
+        unmatched_tracks = [t for r, t in enumerate(track_indices) if r not in used_tracks]
+        unmatched_dets = [d for c, d in enumerate(detection_indices) if c not in used_dets]
+        return matches, unmatched_tracks, unmatched_dets
@@ -0,0 +1,158 @@
+import threading
+import time
+import cv2
+import numpy as np
+from tracking import initialize_tracker
+from events import EventWriter, frame_events
+from process_video import read_frames, detect_frame, track_frame, annotate_frame
+
+class LatestFrame:
+    """
+    Reads a camera (or a file replayed at its native fps) on its own thread and keeps only the
+    newest frame. A frame replaced before anyone took it counts as dropped.
+    """
+
+    def __init__(self, source, replay=False):
+        """
+        :param source: Camera index, stream URL or video file.
+        :param replay: Pace the reads at the source's fps, so a file behaves like a live camera.
+        """
+        self.cap = cv2.VideoCapture(source)
+        self.replay = replay
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 25
+        self.condition = threading.Condition()
+        self.latest = None
+        self.finished = False
+        self.stopped = False
+        self.captured = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._read, daemon=True)
+
+    def start(self):
+        if not self.cap.isOpened():
+            print("Error: Could not open video!")
+            self.finished = True
+            return False
+        self.thread.start()
+        return True
+
+    def _read(self):
+        start = time.monotonic()
+        for index, frame in enumerate(read_frames(self.cap)):
+            if self.stopped:
+                break
+            if self.replay:
+                delay = start + index / self.fps - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            with self.condition:
+                if self.latest is not None:
+                    self.dropped += 1
+                self.latest = (index, time.monotonic(), frame)
+                self.captured += 1
+                self.condition.notify()
+        with self.condition:
+            self.finished = True
+            self.condition.notify()
+
+    def get(self):
+        """ Waits for and takes the newest frame as (index, captured_at, frame); None once the source ends. """
+        with self.condition:
+            while self.latest is None and not self.finished:
+                self.condition.wait()
+            latest, self.latest = self.latest, None
+            return latest
+
+    def stop(self):
+        self.stopped = True
+        if self.thread.is_alive():
+            self.thread.join()
+        self.cap.release()
+
+def process_live(source, vehicle_model, rider_model, helmet_model, output_path=None, events_path=None,
+                 max_latency=0.2, replay=False, tracker_backend="deepsort", detect_width=None,
+                 roi=None, helmet_imgsz=640):
+    """
+    Processes a live source in real time with an end-to-end latency target.
+
+    Frames are always taken newest-first; frames that arrive while the previous one is still
+    being processed are dropped. When the average latency exceeds max_latency the helmet stage
+    is skipped (triple riding is then judged by rider count only) until the latency is back
+    under 70% of the target.
+
+    :param source: Camera index, stream URL or video file.
+    :param output_path: Optional annotated output video (processed frames only).
+    :param events_path: Optional .jsonl or .parquet events file.
+    :param max_latency: Target seconds from capture to finished processing.
+    :param replay: Replay a video file at its native fps as a stand-in for a camera.
+    :param detect_width: Run the vehicle and rider models on frames resized to this width.
+    :param roi: Optional RoiMask of the camera's road area.
+    :param helmet_imgsz: Input size of the helmet model, see detect_helmets_batch.
+    :return: Dict with captured, processed, dropped and degraded frame counts and latency percentiles.
+    """
+    reader = LatestFrame(source, replay)
+    if not reader.start():
+        return None
+
+    out = None
+    if output_path is not None:
+        width = int(reader.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(reader.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(output_path, fourcc, reader.fps, (width, height))
+    events = EventWriter(events_path) if events_path is not None else None
+    tracker = initialize_tracker(tracker_backend)
+
+    latencies = []
+    average = None
+    degraded = False
+    degraded_frames = 0
+    try:
+        while True:
+            item = reader.get()
+            if item is None:
+                break
+            index, captured_at, frame = item
+
+            non_motorcycles, trapeziums, triple_riding_detections, embeddings, counts = detect_frame(
+                frame, vehicle_model, rider_model, None if degraded else helmet_model, with_counts=True,
+                detect_width=detect_width, roi=roi, helmet_imgsz=helmet_imgsz)
+            tracks = track_frame(tracker, frame, non_motorcycles, trapeziums, embeddings)
+            if events is not None:
+                if degraded:
+                    # Helmets were not looked for, so their counts are unknown rather than zero
+                    counts = [(riders, None, None) for riders, _, _ in counts]
+                events.write(frame_events(index, index / reader.fps, tracks, trapeziums, triple_riding_detections, counts))
+            if out is not None:
+                out.write(annotate_frame(frame, tracks, triple_riding_detections))
+            degraded_frames += degraded
+
+            latency = time.monotonic() - captured_at
+            latencies.append(latency)
+            average = latency if average is None else 0.8 * average + 0.2 * latency
+            if not degraded and average > max_latency:
+                degraded = True
+            elif degraded and average < 0.7 * max_latency:
+                degraded = False
+    finally:
+        reader.stop()
+        if out is not None:
+            out.release()
+        if events is not None:
+            events.close()
+
+    processed = len(latencies)
+    latencies = np.array(latencies or [0.0]) * 1000
+    stats = {
+        'captured': reader.captured,
+        'processed': processed,
+        'dropped': reader.dropped,
+        'degraded': degraded_frames,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'max_ms': float(latencies.max()),
+    }
+    print(f"Live: processed {stats['processed']} of {stats['captured']} frames, dropped {stats['dropped']}, "
+          f"{stats['degraded']} without helmet detection, latency p50 {stats['p50_ms']:.0f} ms, "
+          f"p95 {stats['p95_ms']:.0f} ms")
+    return stats
@@ -1,25 +1,124 @@
+import argparse
 import time
-from ultralytics import YOLO
+import cv2
+from detect_objects import THRESHOLDS
+from detection_cache import DetectionCache
+from model_backends import load_models
+from motion_gate import MotionGate
+from roi_mask import RoiMask
+from live import process_live
 from process_video import process_video
 
-# Start timer
-start_time = time.time()
+def load_config(path):
+    """ Reads a TOML (or, with PyYAML installed, YAML) config file into a dict. """
+    if path.endswith((".yaml", ".yml")):
+        import yaml
+        with open(path) as f:
+            return yaml.safe_load(f)
+    import tomllib
+    with open(path, "rb") as f:
+        return tomllib.load(f)
 
-# Load trained YOLO models
-vehicle_model = YOLO(r"C:\Users\keesa\Desktop\Traffic violation.v4i.yolov9\YOLOv8\Vehicle Detection\runs_vehicle_detection\detect\train\weights\best.pt")
-rider_model = YOLO(r"C:\Users\keesa\Desktop\Traffic violation.v4i.yolov9\YOLOv8\Rider\runs_rider_detection\detect\train\weights\best.pt")
-helmet_model = YOLO(r"C:\Users\keesa\Desktop\Traffic violation.v4i.yolov9\YOLOv8\Helmet_detection\runs\detect\train\weights\best.pt")
+def model_specs(config):
+    """ The vehicle, rider and helmet model specs of a config; a plain string is a weights path. """
+    models = config.get("models", {})
+    specs = {}
+    for name in ("vehicle", "rider", "helmet"):
+        spec = models.get(name)
+        specs[name] = {'weights': spec} if isinstance(spec, str) else spec
+    if not specs["vehicle"] or not specs["helmet"]:
+        raise ValueError("The config needs a vehicle and a helmet model")
+    return specs
 
-# Define video paths
-video_path = r"C:\Users\keesa\Desktop\Traffic violation.v4i.yolov9\YOLOv8\TVDS\test_2.mp4"
-output_path = r"C:\Users\keesa\Desktop\Traffic violation.v4i.yolov9\YOLOv8\TVDS\output_video5.mp4"
+def run(config, loader=None):
+    """
+    Loads the configured models once, then processes every configured source with them.
 
-# Run processing
-process_video(video_path, vehicle_model, rider_model, helmet_model, output_path)
+    :param loader: Optional function (weights, backend) -> model, for model_backends.load_models.
+    :return: Dict with the startup seconds and per-source {'frames', 'seconds', 'fps'}.
+    """
+    thresholds = config.get("thresholds", {})
+    unknown = set(thresholds) - set(THRESHOLDS)
+    if unknown:
+        raise ValueError(f"Unknown thresholds: {sorted(unknown)} (expected some of {sorted(THRESHOLDS)})")
+    THRESHOLDS.update(thresholds)
 
-# End timer
-end_time = time.time()
+    # Startup: load and warm up all models in parallel; a cache replay needs none of them
+    specs = model_specs(config)
+    cache = config.get("cache")
+    replay = bool(cache and cache.get("replay"))
+    start = time.perf_counter()
+    if replay:
+        models, load_seconds = {name: None for name in specs}, {}
+    else:
+        models, load_seconds = load_models(specs, loader)
+    startup = time.perf_counter() - start
+    for name, seconds in load_seconds.items():
+        print(f"Loaded {name} model in {seconds:.2f} seconds")
+    print(f"Startup time: {startup:.2f} seconds")
 
-# Print execution time
-total_time = end_time - start_time
-print(f"Total execution time: {total_time:.2f} seconds")
+    # The helmet model is warmed up and run at the same input size
+    helmet_imgsz = specs["helmet"].get("imgsz", 640)
+
+    report = {'startup': startup, 'sources': {}}
+    for source in config.get("sources", []):
+        roi = RoiMask(source["roi"], **config.get("roi", {})) if source.get("roi") else None
+        if source.get("live") and replay:
+            raise ValueError(f"The live source {source['video']} cannot be replayed from the detection cache")
+        if source.get("live"):
+            report['sources'][source["video"]] = process_live(
+                source["video"], models["vehicle"], models["rider"], models["helmet"],
+                output_path=source.get("output"), events_path=source.get("events"),
+                max_latency=source.get("max_latency", 0.2), replay=source.get("replay", False),
+                tracker_backend=config.get("process", {}).get("tracker_backend", "deepsort"),
+                detect_width=source.get("detect_width", config.get("process", {}).get("detect_width")), roi=roi,
+                helmet_imgsz=helmet_imgsz)
+            continue
+
+        options = dict(config.get("process", {}), helmet_imgsz=helmet_imgsz)
+        # Per-camera detection settings override the [process] ones
+        for key in ("detect_width", "tiling"):
+            if key in source:
+                options[key] = source[key]
+        if roi is not None:
+            options["roi"] = roi
+        if cache:
+            weights = {name: spec['weights'] if spec else None for name, spec in specs.items()}
+            options["detection_cache"] = DetectionCache(cache["directory"], source["video"], weights, replay)
+        gate = options.pop("motion_gate", None)
+        if gate:
+            options["motion_gate"] = MotionGate(**(gate if isinstance(gate, dict) else {}))
+
+        cap = cv2.VideoCapture(source["video"])
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        # Steady state: processing only, models already warm
+        start = time.perf_counter()
+        process_video(source["video"], models["vehicle"], models["rider"], models["helmet"],
+                      output_path=source.get("output", "output_video.mp4"), events_path=source.get("events"),
+                      evidence_dir=source.get("evidence"), **options)
+        seconds = time.perf_counter() - start
+        fps = frames / seconds if seconds else 0.0
+        report['sources'][source["video"]] = {'frames': frames, 'seconds': seconds, 'fps': fps}
+        print(f"Processed {source['video']}: {frames} frames in {seconds:.2f} seconds ({fps:.1f} fps)")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect triple riding and helmet violations in videos.")
+    parser.add_argument("config", help="TOML or YAML config file (see config.example.toml)")
+    parser.add_argument("--video", help="Process this video instead of the configured sources")
+    parser.add_argument("--output", help="Output video path for --video")
+    parser.add_argument("--events", help="Events file (.jsonl or .parquet) for --video")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.video:
+        source = {'video': args.video, 'events': args.events}
+        if args.output:
+            source['output'] = args.output
+        config["sources"] = [source]
+    run(config)
+
+if __name__ == "__main__":
+    main()
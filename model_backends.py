@@ -0,0 +1,274 @@
+"""
+Exported CPU inference backends for the vehicle, rider and helmet models.
+
+ultralytics runs exported ONNX and OpenVINO models behind the same YOLO interface as .pt
+weights, so detect_objects works unchanged with whichever backend each model is loaded with.
+
+    python model_backends.py export helmet.pt --backend openvino --int8 --video calib.mp4 --crops vehicle.pt rider.pt
+    python model_backends.py compare vehicle.pt vehicle.onnx vehicle_int8.onnx --video test.mp4
+"""
+import argparse
+import os
+import tempfile
+import time
+import cv2
+import numpy as np
+from detect_objects import THRESHOLDS, detect_objects_batch
+from helmet_detection import crop_envelope, letterbox
+from trapezium import build_trapeziums
+from utils import assign_riders_to_motorcycles, iou_matrix
+
+BACKENDS = ("pytorch", "onnx", "openvino")
+
+def load_model(path, backend=None):
+    """
+    Loads a model for inference with the backend its weights were exported for.
+
+    :param path: .pt weights, an .onnx file or an OpenVINO "*_openvino_model" directory.
+    :param backend: Expected backend; checked against the path when given.
+    """
+    from ultralytics import YOLO
+
+    detected = model_backend(path)
+    if backend is not None and backend != detected:
+        raise ValueError(f"{path} is a {detected} model, not {backend}")
+    return YOLO(path, task="detect")
+
+def warm_up(model, imgsz=640, batch_size=1):
+    """
+    Runs the model once on blank images, so weight loading, graph compilation and memory
+    allocation happen before the first real frame instead of delaying it.
+    """
+    dummy = np.zeros((imgsz, imgsz, 3), np.uint8)
+    detect_objects_batch(model, [dummy] * batch_size, imgsz)
+
+def load_models(specs, loader=None):
+    """
+    Loads and warms up several models in parallel threads.
+
+    :param specs: Dict of name -> {'weights', optional 'backend', 'imgsz', 'warmup_batch'}; a None
+                  spec gives a None model (e.g. no rider model next to a merged model).
+    :param loader: Function (weights, backend) -> model. Defaults to load_model.
+    :return: Dict of name -> model, plus the seconds every model took to load and warm up.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    loader = loader or load_model
+
+    def load(spec):
+        start = time.perf_counter()
+        model = loader(spec['weights'], spec.get('backend'))
+        warm_up(model, spec.get('imgsz', 640), spec.get('warmup_batch', 1))
+        return model, time.perf_counter() - start
+
+    wanted = {name: spec for name, spec in specs.items() if spec}
+    with ThreadPoolExecutor(max_workers=max(1, len(wanted))) as pool:
+        futures = {name: pool.submit(load, spec) for name, spec in wanted.items()}
+        loaded = {name: future.result() for name, future in futures.items()}
+
+    models = {name: loaded[name][0] if name in loaded else None for name in specs}
+    seconds = {name: loaded[name][1] for name in loaded}
+    return models, seconds
+
+def model_backend(path):
+    """ Backend of a weights path: "pytorch", "onnx" or "openvino". """
+    path = str(path).rstrip("/\\")
+    if path.endswith(".onnx"):
+        return "onnx"
+    if path.endswith("_openvino_model") or path.endswith(".xml"):
+        return "openvino"
+    return "pytorch"
+
+def calibration_frames(video_path, count=200):
+    """ Up to count frames spread evenly over a video, to calibrate INT8 quantization on our own footage. """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print("Error: Could not open video!")
+        return []
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for index in np.linspace(0, max(total - 1, 0), min(count, max(total, 1))).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(frame)
+    cap.release()
+    return frames
+
+def helmet_calibration_crops(frames, vehicle_model, rider_model):
+    """ Trapezium crops of the given frames, which is what the helmet model actually sees. """
+    crops = []
+    for frame, vehicles, riders in zip(frames, detect_objects_batch(vehicle_model, frames), detect_objects_batch(rider_model, frames)):
+        motorcycles = vehicles[vehicles.cls == THRESHOLDS['motorcycle_class']]
+        assignments = assign_riders_to_motorcycles(motorcycles, riders)
+        for envelope in build_trapeziums(motorcycles, assignments, frame.shape)[1]:
+            crop = crop_envelope(frame, envelope)
+            if crop is not None:
+                crops.append(crop[0])
+    return crops
+
+def _write_calibration_dataset(images, names, directory):
+    """ Writes images as an ultralytics dataset (no labels) and returns its YAML path. """
+    image_dir = os.path.join(directory, "images")
+    os.makedirs(image_dir, exist_ok=True)
+    for i, image in enumerate(images):
+        cv2.imwrite(os.path.join(image_dir, f"{i:05d}.jpg"), image)
+    yaml_path = os.path.join(directory, "calibration.yaml")
+    with open(yaml_path, "w") as f:
+        f.write(f"path: {directory}\ntrain: images\nval: images\nnames:\n")
+        for class_id, name in names.items():
+            f.write(f"  {class_id}: {name}\n")
+    return yaml_path
+
+class _CalibrationReader:
+    """ onnxruntime CalibrationDataReader over letterboxed calibration images. """
+
+    def __init__(self, input_name, images, imgsz):
+        self.input_name = input_name
+        self.images = iter(images)
+        self.imgsz = imgsz
+
+    def get_next(self):
+        image = next(self.images, None)
+        if image is None:
+            return None
+        padded, _, _ = letterbox(image, self.imgsz)
+        tensor = padded[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255
+        return {self.input_name: np.ascontiguousarray(tensor)}
+
+def _quantize_onnx(fp32_path, images, imgsz):
+    """ Static INT8 quantization of an exported ONNX model, keeping ultralytics' metadata. """
+    import onnx
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    model = onnx.load(fp32_path)
+    int8_path = fp32_path[:-len(".onnx")] + "_int8.onnx"
+    reader = _CalibrationReader(model.graph.input[0].name, images, imgsz)
+    quantize_static(fp32_path, int8_path, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+    # ultralytics reads the class names and image size from the model metadata
+    quantized = onnx.load(int8_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(model.metadata_props)
+    onnx.save(quantized, int8_path)
+    return int8_path
+
+def export_model(weights, backend, int8=False, calibration_images=None, imgsz=640):
+    """
+    Exports .pt weights for a CPU inference backend.
+
+    :param backend: "onnx" or "openvino".
+    :param int8: Quantize to INT8, calibrated on calibration_images (frames for the vehicle and
+                 rider models, trapezium crops for the helmet model).
+    :param imgsz: Network input size. Exports use a dynamic batch size for batched calls.
+    :return: Path of the exported model.
+    """
+    from ultralytics import YOLO
+
+    if backend not in ("onnx", "openvino"):
+        raise ValueError(f"Unknown export backend: {backend} (expected 'onnx' or 'openvino')")
+    if int8 and not calibration_images:
+        raise ValueError("INT8 export needs calibration images")
+
+    model = YOLO(weights)
+    if backend == "onnx":
+        path = model.export(format="onnx", imgsz=imgsz, dynamic=True)
+        return _quantize_onnx(path, calibration_images, imgsz) if int8 else path
+
+    if not int8:
+        return model.export(format="openvino", imgsz=imgsz, dynamic=True)
+    with tempfile.TemporaryDirectory() as directory:
+        data = _write_calibration_dataset(calibration_images, model.names, directory)
+        return model.export(format="openvino", imgsz=imgsz, dynamic=True, int8=True, data=data)
+
+def _match(reference, candidate, iou_threshold):
+    """ Number of same-class boxes matched one-to-one between two Detections at iou_threshold. """
+    if not len(reference) or not len(candidate):
+        return 0
+    ious = iou_matrix(reference.xyxy, candidate.xyxy)
+    ious[reference.cls[:, None] != candidate.cls[None, :]] = 0
+    matched = 0
+    while True:
+        i, j = np.unravel_index(np.argmax(ious), ious.shape)
+        if ious[i, j] < iou_threshold:
+            return matched
+        matched += 1
+        ious[i, :] = 0
+        ious[:, j] = 0
+
+def compare_backends(models, images, iou_threshold=0.5):
+    """
+    Latency and agreement of several variants of one model on the same images.
+
+    The first model is the reference (usually the .pt weights). Agreement is measured as the
+    precision and recall of every variant's boxes against the reference's boxes.
+
+    :param models: Dict of label -> loaded model, reference first.
+    :return: Dict of label -> {'p50_ms', 'p95_ms', 'images_per_second', 'precision', 'recall'}.
+    """
+    outputs = {}
+    report = {}
+    for label, model in models.items():
+        detect_objects_batch(model, images[:1])  # Warm-up
+        latencies = []
+        outputs[label] = []
+        for image in images:
+            start = time.perf_counter()
+            outputs[label].extend(detect_objects_batch(model, [image]))
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+        report[label] = {
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'images_per_second': float(1000 / latencies.mean()),
+        }
+
+    reference = outputs[next(iter(models))]
+    for label in models:
+        matched = sum(_match(r, c, iou_threshold) for r, c in zip(reference, outputs[label]))
+        found = sum(len(c) for c in outputs[label])
+        expected = sum(len(r) for r in reference)
+        report[label]['precision'] = matched / found if found else 1.0
+        report[label]['recall'] = matched / expected if expected else 1.0
+    return report
+
+def print_report(report):
+    print(f"{'model':<40}{'p50 ms':>9}{'p95 ms':>9}{'img/s':>9}{'precision':>11}{'recall':>9}")
+    for label, r in report.items():
+        print(f"{label:<40}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['images_per_second']:>9.1f}"
+              f"{r['precision']:>11.3f}{r['recall']:>9.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the TVDS models to ONNX/OpenVINO and compare backends.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export .pt weights, optionally INT8-quantized")
+    export.add_argument("weights")
+    export.add_argument("--backend", choices=["onnx", "openvino"], required=True)
+    export.add_argument("--int8", action="store_true")
+    export.add_argument("--video", help="Video to take calibration frames from")
+    export.add_argument("--frames", type=int, default=200, help="Number of calibration frames")
+    export.add_argument("--crops", nargs=2, metavar=("VEHICLE", "RIDER"),
+                        help="Calibrate on trapezium crops found by these models (for the helmet model)")
+    export.add_argument("--imgsz", type=int, default=640)
+
+    comparison = commands.add_parser("compare", help="Compare latency and agreement of model variants")
+    comparison.add_argument("models", nargs="+", help="Variants of one model; the first is the reference")
+    comparison.add_argument("--video", required=True)
+    comparison.add_argument("--frames", type=int, default=100)
+    comparison.add_argument("--crops", nargs=2, metavar=("VEHICLE", "RIDER"),
+                            help="Compare on trapezium crops found by these models (for the helmet model)")
+    args = parser.parse_args()
+
+    images = calibration_frames(args.video, args.frames) if args.video else []
+    if args.crops and images:
+        images = helmet_calibration_crops(images, load_model(args.crops[0]), load_model(args.crops[1]))
+
+    if args.command == "export":
+        print(f"Exported to {export_model(args.weights, args.backend, args.int8, images, args.imgsz)}")
+    else:
+        print_report(compare_backends({path: load_model(path) for path in args.models}, images))
+
+if __name__ == "__main__":
+    main()
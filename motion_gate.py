@@ -0,0 +1,137 @@
+import cv2
+from detect_objects import detect_objects_batch
+from detections import Detections
+
+class MotionGate:
+    """
+    Background subtraction in front of the detectors.
+
+    Every frame is fed, downscaled, to a MOG2 background model. Frames already downscaled for
+    detection (process_video's detect_width) are only shrunk further when they are still larger
+    than the background model's input, never resized from full resolution again. Frames without
+    motion skip detection entirely; frames with motion are only detected inside the padded
+    bounding boxes of their moving regions. Vehicles that stand still long enough become
+    background and are no longer detected, which is fine for the rider checks but not for
+    counting parked vehicles.
+    """
+
+    def __init__(self, scale=0.25, history=500, var_threshold=16, min_area=400, pad=32, full_frame_ratio=0.5):
+        """
+        :param scale: Downscale factor of the full-resolution frames the background model runs on.
+        :param min_area: Smallest moving region, in full-resolution pixels, that counts as motion.
+        :param pad: Full-resolution pixels added around every moving region so objects are not cut at its edges.
+        :param full_frame_ratio: Detect on the whole frame once the regions cover more than this fraction of it.
+        """
+        self.scale = scale
+        self.min_area = min_area
+        self.pad = pad
+        self.full_frame_ratio = full_frame_ratio
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(history=history, varThreshold=var_threshold, detectShadows=False)
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self.frames = 0
+        self.skipped = 0
+        self.total_pixels = 0
+        self.inferred_pixels = 0
+
+    def regions(self, frame, within=None, frame_scale=1.0):
+        """
+        Moving regions of a frame.
+
+        :param within: Optional list of (x1, y1, x2, y2) boxes (e.g. RoiMask crops) the regions are
+                       clipped to, before they are counted in stats().
+        :param frame_scale: Downscale factor of the frame (full resolution / its size), e.g. for the
+                            detect_width copies; scale, min_area and pad stay relative to full resolution.
+        :return: List of (x1, y1, x2, y2) integer boxes in frame coordinates; empty for a static frame.
+        """
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.scale * frame_scale)
+        small = frame
+        if scale != 1.0:
+            small = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        mask = self.subtractor.apply(small)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+        mask = cv2.dilate(mask, self.kernel, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        # min_area and pad in the frame's own pixels
+        min_area = self.min_area / (frame_scale * frame_scale)
+        pad = int(round(self.pad / frame_scale))
+        boxes = []
+        for contour in contours:
+            x, y, bw, bh = cv2.boundingRect(contour)
+            if bw * bh / (scale * scale) < min_area:
+                continue
+            boxes.append([
+                max(0, int(x / scale) - pad), max(0, int(y / scale) - pad),
+                min(w, int((x + bw) / scale) + pad), min(h, int((y + bh) / scale) + pad),
+            ])
+        boxes = _merge_boxes(boxes)
+
+        area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in boxes)
+        if area > self.full_frame_ratio * w * h:
+            boxes, area = [(0, 0, w, h)], w * h
+        if within is not None:
+            boxes = intersect_regions(boxes, within)
+            area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in boxes)
+
+        self.frames += 1
+        self.total_pixels += w * h
+        self.inferred_pixels += area
+        if not boxes:
+            self.skipped += 1
+        return boxes
+
+    def stats(self):
+        """ Dict of gated frames, skipped static frames and the fraction of pixels sent to the detectors. """
+        return {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'inferred_fraction': self.inferred_pixels / self.total_pixels if self.total_pixels else 0.0,
+        }
+
+def _merge_boxes(boxes):
+    """ Merges overlapping boxes until none overlap, so no object is detected twice. """
+    boxes = [list(box) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(box) for box in boxes]
+
+def intersect_regions(regions, boxes):
+    """ Intersections of every region with every box, e.g. the moving parts of the ROI crops. """
+    clipped = []
+    for x1, y1, x2, y2 in regions:
+        for bx1, by1, bx2, by2 in boxes:
+            box = (max(x1, bx1), max(y1, by1), min(x2, bx2), min(y2, by2))
+            if box[2] > box[0] and box[3] > box[1]:
+                clipped.append(box)
+    return clipped
+
+def detect_in_regions(model, frames, regions):
+    """
+    Runs the model once on the region crops of a batch of frames.
+
+    :param regions: One list of (x1, y1, x2, y2) boxes per frame.
+    :return: One Detections per frame in full-frame coordinates; empty for frames without regions.
+    """
+    crops = []
+    owners = []
+    for i, (frame, boxes) in enumerate(zip(frames, regions)):
+        for x1, y1, x2, y2 in boxes:
+            crops.append(frame[y1:y2, x1:x2])
+            owners.append((i, x1, y1))
+
+    per_frame = [[] for _ in frames]
+    for (i, x1, y1), detections in zip(owners, detect_objects_batch(model, crops)):
+        per_frame[i].append(detections.offset(x1, y1))
+    return [Detections.concat(parts) for parts in per_frame]
@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+import cv2
+from tracking import initialize_tracker
+from process_video import read_frames, detect_frames, track_frame, annotate_frame
+
+_END = object()
+
+class _Stream:
+    """ Per-camera state: capture, reader thread, frame queue, tracker and output writer. """
+
+    def __init__(self, name, source, output_path, tracker_backend, queue_size):
+        self.name = name
+        self.cap = cv2.VideoCapture(source)
+        self.out = None
+        self.finished = False
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.tracker = initialize_tracker(tracker_backend)
+        self.processed = 0
+        self.latencies = []
+
+        if not self.cap.isOpened():
+            print(f"Error: Could not open video for stream {name}!")
+            self.finished = True
+            return
+
+        width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+    def read(self, stop):
+        """ Decode frames into the bounded queue until the stream ends or the runner stops. """
+        for frame in read_frames(self.cap):
+            item = (time.monotonic(), frame)
+            while not stop.is_set():
+                try:
+                    self.frames.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+        while not stop.is_set():
+            try:
+                self.frames.put(_END, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def release(self):
+        self.cap.release()
+        if self.out is not None:
+            self.out.release()
+
+def _gather(streams, start, max_batch, max_latency):
+    """
+    Collect up to max_batch frames round-robin across streams, one frame per stream per pass.
+
+    Returns as soon as the batch is full, or once its oldest frame has waited max_latency
+    seconds. Rotating start between batches keeps any one stream from always going first.
+    """
+    batch = []
+    order = streams[start:] + streams[:start]
+    while True:
+        active = [s for s in order if not s.finished]
+        progressed = False
+        for stream in active:
+            try:
+                item = stream.frames.get_nowait()
+            except queue.Empty:
+                continue
+            if item is _END:
+                stream.finished = True
+                continue
+            batch.append((stream,) + item)
+            progressed = True
+            if len(batch) >= max_batch:
+                return batch
+
+        if not any(not s.finished for s in streams):
+            return batch
+        if batch and time.monotonic() - min(decoded_at for _, decoded_at, _ in batch) >= max_latency:
+            return batch
+        if not progressed:
+            time.sleep(0.001)
+
+def process_streams(sources, output_paths, vehicle_model, rider_model, helmet_model,
+                    max_batch=8, max_latency=0.1, queue_size=4, tracker_backend="deepsort"):
+    """
+    Processes many video streams with one shared copy of each model.
+
+    Every stream is decoded on its own thread. A scheduler gathers frames from all streams
+    into shared detection batches, then tracks and annotates each frame with its own stream's
+    tracker and writes it to that stream's output.
+
+    :param sources: List of video paths or camera URLs.
+    :param output_paths: One output video path per source.
+    :param max_batch: Maximum frames per shared inference batch.
+    :param max_latency: Maximum seconds a frame waits for its batch to fill.
+    :param queue_size: Decoded frames buffered per stream; a full queue pauses that stream's decoder.
+    :param tracker_backend: Tracker backend for tracking.initialize_tracker.
+    :return: Dict of stream name -> {'frames', 'mean_latency', 'max_latency'}.
+    """
+    streams = [
+        _Stream(str(i), source, output_path, tracker_backend, queue_size)
+        for i, (source, output_path) in enumerate(zip(sources, output_paths))
+    ]
+    if not streams:
+        return {}
+    stop = threading.Event()
+    readers = [threading.Thread(target=s.read, args=(stop,), daemon=True) for s in streams if not s.finished]
+    for reader in readers:
+        reader.start()
+
+    start = 0
+    try:
+        while True:
+            batch = _gather(streams, start, max_batch, max_latency)
+            start = (start + 1) % len(streams)
+            if not batch:
+                break
+
+            results = detect_frames([frame for _, _, frame in batch], vehicle_model, rider_model, helmet_model)
+            for (stream, decoded_at, frame), (non_motorcycles, trapeziums, triple_riding_detections, embeddings) in zip(batch, results):
+                tracks = track_frame(stream.tracker, frame, non_motorcycles, trapeziums, embeddings)
+                stream.out.write(annotate_frame(frame, tracks, triple_riding_detections))
+                stream.processed += 1
+                stream.latencies.append(time.monotonic() - decoded_at)
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+        for stream in streams:
+            stream.release()
+
+    stats = {}
+    for stream in streams:
+        latencies = stream.latencies or [0.0]
+        stats[stream.name] = {
+            'frames': stream.processed,
+            'mean_latency': sum(latencies) / len(latencies),
+            'max_latency': max(latencies),
+        }
+        print(f"Stream {stream.name}: {stream.processed} frames, "
+              f"mean latency {stats[stream.name]['mean_latency'] * 1000:.1f} ms, "
+              f"max latency {stats[stream.name]['max_latency'] * 1000:.1f} ms")
+    return stats
@@ -0,0 +1,160 @@
+import queue
+import threading
+import time
+
+_END = object()
+
+
+def _put(q, item, stop):
+    """ Put an item on a bounded queue, giving up if the pipeline is stopping. """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    """ Get an item from a queue, returning the end marker if the pipeline is stopping. """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def run_pipeline(source, stages, sink, queue_size=8):
+    """
+    Runs a source, a chain of stages and a sink concurrently, one thread per stage.
+
+    Stages are connected by bounded queues, so a slow stage applies backpressure to the
+    ones before it. Every stage is a single thread and the queues are FIFO, so items reach
+    the sink in the order the source produced them.
+
+    :param source: Iterable producing the input items (e.g. decoded frames).
+    :param stages: List of callables, each mapping one item to the next stage's input.
+    :param sink: Callable consuming the output of the last stage; runs on the calling thread.
+    :param queue_size: Maximum number of items waiting between two stages.
+    """
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def produce():
+        try:
+            for item in source:
+                if not _put(queues[0], item, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(queues[0], _END, stop)
+
+    def work(stage, q_in, q_out):
+        try:
+            while True:
+                item = _get(q_in, stop)
+                if item is _END:
+                    break
+                if not _put(q_out, stage(item), stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(q_out, _END, stop)
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(threading.Thread(target=work, args=(stage, queues[i], queues[i + 1]), daemon=True))
+    for t in threads:
+        t.start()
+
+    try:
+        while True:
+            item = _get(queues[-1], stop)
+            if item is _END:
+                break
+            sink(item)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    if errors:
+        raise errors[0]
+
+
+def batched(source, batch_size, max_wait=None):
+    """
+    Groups items from a source into lists of up to batch_size items.
+
+    :param source: Iterable producing the items (e.g. decoded frames).
+    :param batch_size: Maximum number of items per batch.
+    :param max_wait: Maximum time in seconds the first item of a batch waits for the batch
+                     to fill. A partial batch is emitted once it expires. None waits until the
+                     batch is full or the source ends.
+    """
+    if max_wait is None:
+        batch = []
+        for item in source:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    # Read the source on its own thread so the wait can expire while the source blocks
+    stop = threading.Event()
+    errors = []
+    q = queue.Queue(maxsize=batch_size)
+
+    def produce():
+        try:
+            for item in source:
+                if not _put(q, item, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put(q, _END, stop)
+
+    reader = threading.Thread(target=produce, daemon=True)
+    reader.start()
+
+    try:
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = q.get(timeout=timeout)
+            except queue.Empty:
+                yield batch
+                batch = []
+                continue
+            if item is _END:
+                break
+            if not batch:
+                deadline = time.monotonic() + max_wait
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        stop.set()
+        reader.join()
+
+    if errors:
+        raise errors[0]
@@ -1,12 +1,325 @@
 import cv2
-from detect_objects import detect_objects
-from tracking import initialize_tracker, update_tracker
-from trapezium import create_trapezium
+from detect_objects import THRESHOLDS, detect_objects_batch, detect_objects_tiled, rider_class_ids, split_riders
+from detections import Detections
+from tracking import initialize_tracker, update_tracker, predict_tracker
+from trapezium import build_trapeziums, trapezium_envelopes
 from utils import assign_riders_to_motorcycles
-from helmet_detection import detect_helmets
+from helmet_detection import detect_helmets_batch
+from pipeline import run_pipeline, batched
+from detection_stride import DetectionStride
+from feature_embedder import FeatureEmbedder
+from events import EventWriter, frame_events, helmet_counts, read_events
+from evidence import ClipRecorder
+from motion_gate import detect_in_regions
+from profiling import stage, count_frame, enable_profiling, disable_profiling
+from itertools import count, groupby
 import numpy as np
 
-def process_video(video_path, vehicle_model, rider_model, helmet_model, output_path="output_video.mp4"):
+def read_frames(cap):
+    """ Yield frames from an opened cv2.VideoCapture until the stream ends. """
+    while cap.isOpened():
+        with stage("decode"):
+            ret, frame = cap.read()
+        if not ret:
+            break
+        count_frame()
+        yield frame
+
+def blank_frames(n, width, height):
+    """ Yield n stand-ins for frames that are never looked at: zero-copy black arrays of the video's frame shape. """
+    frame = np.broadcast_to(np.zeros((1, 1, 3), np.uint8), (height, width, 3))
+    for _ in range(n):
+        count_frame()
+        yield frame
+
+def detection_frames(frames, detect_width=None):
+    """
+    The copies of frames the vehicle and rider models see, resized once to detect_width.
+
+    :return: Tuple of (frames, scale), where scale maps detection back to full-resolution coordinates.
+             Frames no wider than detect_width are passed through unchanged with a scale of 1.
+    """
+    if detect_width is None or not frames or frames[0].shape[1] <= detect_width:
+        return frames, 1.0
+    h, w = frames[0].shape[:2]
+    size = (int(detect_width), max(1, int(round(h * detect_width / w))))
+    with stage("resize"):
+        small = [cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in frames]
+    return small, w / size[0]
+
+def detect_frames(frames, vehicle_model, rider_model, helmet_model, embedder=None, with_counts=False, motion_gate=None,
+                  rider_classes=None, detect_width=None, tiling=None, roi=None, cache=None, frame_indices=None,
+                  helmet_imgsz=640, small_frames=None):
+    """
+    Runs the vehicle and rider models once on a batch of frames, then finishes every frame.
+
+    With rider_model=None, vehicle_model is a single merged model trained on the vehicle and rider
+    classes; its output is split into vehicles and riders, halving the full-frame model calls.
+
+    :param embedder: Optional FeatureEmbedder on vehicle_model; tracker detections then get
+                     embeddings pooled from the vehicle model's own feature maps.
+    :param with_counts: Append the per-trapezium (riders, helmets, no_helmets) counts to every tuple.
+    :param motion_gate: Optional MotionGate; the models then only see the moving regions of each
+                        frame and skip static frames. Frames must be passed in video order.
+    :param rider_classes: Rider class IDs of the merged model. By default its classes named "rider".
+    :param detect_width: Run the vehicle and rider models (and the motion gate) on copies of the
+                         frames resized to this width. Their boxes are mapped back to full
+                         resolution, and helmets are still detected on full-resolution crops.
+    :param tiling: Optional dict of detect_objects_tiled keyword arguments (tile_size, overlap,
+                   far_field, iou_threshold); the vehicle and rider models then also see
+                   overlapping tiles of every frame.
+    :param roi: Optional RoiMask; the vehicle and rider models then only see its crops, and
+                detections centred outside its polygons are dropped.
+    :param cache: Optional opened DetectionCache; cached frames and helmet crops skip their models.
+    :param frame_indices: Video frame index of every frame, the key of the cache.
+    :param helmet_imgsz: Input size of the helmet model, see detect_helmets_batch.
+    :param small_frames: The detect_width copies of the frames if they were already made, e.g. for
+                         the detection stride; by default detection_frames makes them.
+    :return: One (non_motorcycles, trapeziums, triple_riding_detections, embeddings) tuple per
+             frame, in order. embeddings is None without an embedder.
+    """
+    if cache is not None and (cache.replay or cache.has_frames(frame_indices)):
+        vehicles_batch, riders_batch = cache.frames(frame_indices)
+    else:
+        vehicles_batch, riders_batch, small_frames, scale = detect_vehicles_and_riders(
+            frames, vehicle_model, rider_model, motion_gate, rider_classes, detect_width, tiling, roi, small_frames)
+        if cache is not None:
+            cache.put_frames(frame_indices, vehicles_batch, riders_batch)
+
+    results = []
+    for i, (frame, vehicles, riders) in enumerate(zip(frames, vehicles_batch, riders_batch)):
+        rules = apply_rules(frame, vehicles, riders, helmet_model, with_counts, cache,
+                            frame_indices[i] if cache is not None else None, helmet_imgsz)
+        non_motorcycles, trapeziums = rules[:2]
+        embeddings = None
+        if embedder is not None:
+            boxes = tracking_detections(non_motorcycles, trapeziums).xyxy
+            embeddings = embedder.embed(i, boxes / scale, small_frames[i].shape)
+        results.append(rules[:3] + (embeddings,) + rules[3:])
+    return results
+
+def detect_vehicles_and_riders(frames, vehicle_model, rider_model, motion_gate=None, rider_classes=None,
+                               detect_width=None, tiling=None, roi=None, small_frames=None):
+    """
+    Runs the vehicle and rider models once on a batch of frames; see detect_frames for the options.
+
+    :return: Tuple of (vehicles_batch, riders_batch, detection_frames, scale): one full-resolution
+             Detections per frame for either model, plus the frames the models saw and their scale.
+    """
+    if small_frames is None:
+        small_frames, scale = detection_frames(frames, detect_width)
+    else:
+        scale = frames[0].shape[1] / small_frames[0].shape[1]
+    roi_boxes = roi.boxes(frames[0].shape, scale) if roi is not None and frames else None
+    if motion_gate is not None:
+        with stage("motion_gate"):
+            regions = [motion_gate.regions(frame, roi_boxes, scale) for frame in small_frames]
+        detect = lambda model: detect_in_regions(model, small_frames, regions)
+    elif roi_boxes is not None:
+        detect = lambda model: detect_in_regions(model, small_frames, [roi_boxes] * len(small_frames))
+    elif tiling is not None:
+        detect = lambda model: detect_objects_tiled(model, small_frames, **tiling)
+    else:
+        detect = lambda model: detect_objects_batch(model, small_frames)
+
+    if rider_model is None:
+        if rider_classes is None:
+            rider_classes = rider_class_ids(vehicle_model)
+        with stage("vehicle_model"):
+            split = [split_riders(detections, rider_classes) for detections in detect(vehicle_model)]
+        vehicles_batch = [vehicles for vehicles, _ in split]
+        riders_batch = [riders for _, riders in split]
+    else:
+        with stage("vehicle_model"):
+            vehicles_batch = detect(vehicle_model)
+        with stage("rider_model"):
+            riders_batch = detect(rider_model)
+
+    if scale != 1.0:
+        vehicles_batch = [vehicles.scale(scale) for vehicles in vehicles_batch]
+        riders_batch = [riders.scale(scale) for riders in riders_batch]
+
+    if roi is not None:
+        with stage("roi"):
+            vehicles_batch = [roi.inside(vehicles, frame.shape) for frame, vehicles in zip(frames, vehicles_batch)]
+            riders_batch = [roi.inside(riders, frame.shape) for frame, riders in zip(frames, riders_batch)]
+    return vehicles_batch, riders_batch, small_frames, scale
+
+def detect_frame(frame, vehicle_model, rider_model, helmet_model, embedder=None, with_counts=False, motion_gate=None,
+                 rider_classes=None, detect_width=None, tiling=None, roi=None, cache=None, frame_index=None,
+                 helmet_imgsz=640, small_frame=None):
+    """
+    Runs the vehicle, rider and helmet models on a frame and applies the triple riding check.
+
+    :return: Tuple of (non_motorcycles, trapeziums, triple_riding_detections, embeddings),
+             plus the per-trapezium counts with with_counts.
+    """
+    return detect_frames([frame], vehicle_model, rider_model, helmet_model, embedder, with_counts, motion_gate,
+                         rider_classes, detect_width, tiling, roi, cache, [frame_index], helmet_imgsz,
+                         None if small_frame is None else [small_frame])[0]
+
+def apply_rules(frame, vehicles, riders, helmet_model, with_counts=False, cache=None, frame_index=None, helmet_imgsz=640):
+    """
+    Builds trapeziums from a frame's vehicle and rider detections and applies the triple riding check.
+
+    With helmet_model=None the helmet stage is skipped and triple riding is judged by rider count only.
+
+    :param with_counts: Also return one (riders, helmets, no_helmets) tuple per trapezium.
+    :param cache: Optional opened DetectionCache to look the helmet crops of frame_index up in.
+    :param helmet_imgsz: Input size of the helmet model, see detect_helmets_batch.
+    """
+    # Filter out motorcycles
+    motorcycles = vehicles[vehicles.cls == THRESHOLDS['motorcycle_class']]
+    non_motorcycles = vehicles[vehicles.cls != THRESHOLDS['motorcycle_class']]  # Exclude motorcycles
+
+    # Assign riders to motorcycles
+    with stage("assignment"):
+        assignments = assign_riders_to_motorcycles(motorcycles, riders)
+
+    rider_counts = [len(rider_list) for rider_list in assignments.values()]
+    
+    with stage("trapezium"):
+        trapeziums, envelopes = build_trapeziums(motorcycles, assignments, frame.shape)
+
+    # Detect helmets in all trapeziums with one batched helmet model call
+    if cache is not None:
+        helmet_results = cache.helmets(frame_index, frame, helmet_model, trapeziums, envelopes, helmet_imgsz)
+    elif helmet_model is not None:
+        helmet_results = detect_helmets_batch(frame, helmet_model, trapeziums, helmet_imgsz, envelopes)
+    else:
+        helmet_results = [Detections() for _ in trapeziums]
+
+    triple_riding_detections = []
+    counts = []
+    for trapezium, rider_count, helmets in zip(trapeziums, rider_counts, helmet_results):
+        helmet_count = len(helmets)
+        
+        if rider_count > THRESHOLDS['max_riders'] or helmet_count > THRESHOLDS['max_riders']:
+            triple_riding_detections.append(trapezium)
+        if with_counts:
+            counts.append((rider_count,) + helmet_counts(helmets))
+
+    if with_counts:
+        return non_motorcycles, trapeziums, triple_riding_detections, counts
+    return non_motorcycles, trapeziums, triple_riding_detections
+
+def tracking_detections(non_motorcycles, trapeziums):
+    """ The Detections a frame feeds to the tracker: other vehicles plus trapezium envelopes. """
+    helmet_detections = Detections()
+
+    # Convert trapezium to bounding boxes for tracking
+    envelopes = trapezium_envelopes(trapeziums)
+    trapezium_detections = Detections(
+        np.concatenate([(envelopes[:, :2] + envelopes[:, 2:]) / 2, envelopes[:, 2:] - envelopes[:, :2]], axis=1),
+        cls=np.full(len(trapeziums), 'Trapezium', dtype=object)
+    )
+    
+    return Detections.concat([non_motorcycles, helmet_detections, trapezium_detections])
+
+def track_frame(tracker, frame, non_motorcycles, trapeziums, embeddings=None):
+    """ Update the tracker with the vehicles and trapeziums detected in a frame. """
+    all_detections = tracking_detections(non_motorcycles, trapeziums)
+    with stage("tracker"):
+        return update_tracker(tracker, all_detections, frame, embeddings)
+
+def annotate_frame(frame, tracks, triple_riding_detections):
+    """ Draw the confirmed tracks and triple riding trapeziums onto the frame. """
+    with stage("draw"):
+        boxes = [(track.to_ltrb(), track.get_det_class()) for track in tracks if track.is_confirmed()]
+        return draw_annotations(frame, boxes, triple_riding_detections)
+
+def draw_annotations(frame, boxes, triple_riding_detections):
+    """ Draw (ltrb, class_name) boxes and triple riding trapeziums onto the frame. """
+    # Draw tracked bounding boxes
+    for ltrb, class_name in boxes:
+        color = (255, 0, 0)  # Default color
+
+        if class_name in ['Helmet', 'No_Helmet']:
+            color = (0, 255, 0) if class_name == 'Helmet' else (0, 0, 255)
+        
+        cv2.rectangle(frame, (int(ltrb[0]), int(ltrb[1])), (int(ltrb[2]), int(ltrb[3])), color, 2)
+        cv2.putText(frame, class_name, (int(ltrb[0]), int(ltrb[1]) - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    
+    # Draw triple riding bounding boxes
+    for trapezium in triple_riding_detections:
+        pts = np.array(trapezium, np.int32).reshape((-1, 1, 2))
+        cv2.polylines(frame, [pts], isClosed=True, color=(0, 0, 255), thickness=2)
+        cv2.putText(frame, "Triple Riding", (int(trapezium[0][0]), int(trapezium[0][1] - 5)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+
+    return frame
+
+def process_video(video_path, vehicle_model, rider_model, helmet_model, output_path="output_video.mp4",
+                  pipelined=False, queue_size=8, batch_size=1, max_wait=None,
+                  detect_stride=1, motion_threshold=0.04, uncertainty_threshold=0.5, tracker_backend="deepsort",
+                  feature_embeddings=False, events_path=None, headless=False,
+                  evidence_dir=None, clip_before=2.0, clip_after=2.0, motion_gate=None, rider_classes=None,
+                  profile=False, detect_width=None, tiling=None, roi=None, detection_cache=None, helmet_imgsz=640):
+    """
+    Detects, tracks and annotates motorcycles, riders and triple riding in a video.
+
+    Pass rider_model=None to run a single merged vehicle + rider model given as vehicle_model.
+
+    :param pipelined: Run decoding, detection, tracking/annotation and encoding as separate
+                      threads connected by bounded queues. Output is identical to the serial loop.
+    :param queue_size: Maximum number of batches buffered between two pipeline stages.
+    :param batch_size: Number of frames the vehicle and rider models run on at once.
+    :param max_wait: Maximum seconds to wait for a batch to fill before running a partial one.
+    :param detect_stride: Run full detection every detect_stride frames. On the frames in between
+                          the tracker predicts the boxes and trapeziums move with their tracks.
+    :param motion_threshold: Detect early when the scene changes more than this (0-1) since the
+                             last detection. None disables the check.
+    :param uncertainty_threshold: Detect early when a track's Kalman position uncertainty, relative
+                                  to its height, exceeds this. None disables the check.
+    :param tracker_backend: Tracker backend for tracking.initialize_tracker ("deepsort" or "iou").
+    :param feature_embeddings: Feed DeepSORT embeddings ROI-pooled from the vehicle model's feature
+                               maps instead of running DeepSORT's own embedder network.
+    :param events_path: Write per-frame track and trapezium events to this .jsonl or .parquet file.
+    :param headless: Only write events; skip drawing and video encoding. Use render_events to
+                     produce the annotated video from the events later.
+    :param evidence_dir: Instead of the full output video, write one short annotated clip per
+                         violating track (triple riding or a rider without helmet) to this directory.
+    :param clip_before: Seconds of video kept before a violation starts.
+    :param clip_after: Seconds of video kept after a track's last violation.
+    :param motion_gate: Optional MotionGate that skips detection on static frames and limits it to
+                        the moving regions of the others.
+    :param rider_classes: Rider class IDs of the merged model. By default its classes named "rider".
+    :param profile: Time every stage (decode, each model call, assignment, trapezium construction,
+                    helmet cropping, tracker, drawing, encoding) and print p50/p95/p99 and fps.
+    :param detect_width: Run the vehicle and rider models on a copy of every frame resized once
+                         to this width (e.g. 1280 for 4K cameras); boxes are mapped back to full
+                         resolution, and helmet crops, tracking and the output video stay at full
+                         resolution. None detects on the full-resolution frames.
+    :param tiling: Optional dict of detect_objects_tiled keyword arguments, e.g.
+                   {'tile_size': 640, 'overlap': 0.2, 'far_field': 0.5}. Vehicles and riders are
+                   detected on the whole frame plus overlapping tiles of its top far_field rows,
+                   in one batch, and merged with NMS. Finds small distant objects at a lower cost
+                   than a larger model input size.
+    :param roi: Optional RoiMask of the camera's road area. The vehicle and rider models only see
+                its bounding crops, and detections centred outside it are dropped before rider
+                assignment and tracking.
+    :param detection_cache: Optional DetectionCache. Recording runs the models only on what is not
+                            cached yet. Replay (DetectionCache(..., replay=True), models may be None)
+                            only runs rider assignment, trapeziums, helmet rules and tracking. When
+                            replaying headless with the "iou" tracker and no helmet model, the video
+                            is not even decoded.
+    :param helmet_imgsz: Input size of the helmet model, the imgsz of its [models] spec in main.py.
+    :return: The profiling.Profiler summary with profile, otherwise None.
+    """
+    if detect_stride > 1 and (pipelined or batch_size > 1):
+        raise ValueError("detect_stride needs the tracker state of the previous frame and cannot be combined with pipelined or batched detection")
+    if feature_embeddings and tracker_backend != "deepsort":
+        raise ValueError("feature_embeddings only applies to the deepsort tracker backend")
+    if feature_embeddings and motion_gate is not None:
+        raise ValueError("feature_embeddings needs the vehicle model to see whole frames and cannot be combined with motion_gate")
+    if tiling is not None and (motion_gate is not None or feature_embeddings or roi is not None):
+        raise ValueError("tiling cannot be combined with motion_gate, feature_embeddings or roi")
+    if feature_embeddings and roi is not None:
+        raise ValueError("feature_embeddings needs the vehicle model to see whole frames and cannot be combined with roi")
+    if detection_cache is not None and (motion_gate is not None or feature_embeddings):
+        raise ValueError("detection_cache cannot be combined with motion_gate or feature_embeddings")
+    if headless and events_path is None:
+        raise ValueError("headless mode needs an events_path")
+
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print("Error: Could not open video!")
@@ -16,82 +329,176 @@ def process_video(video_path, vehicle_model, rider_model, helmet_model, output_p
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = cap.get(cv2.CAP_PROP_FPS)
     
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-    
-    tracker = initialize_tracker()
+    out = None
+    if not headless and evidence_dir is None:
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    events = EventWriter(events_path) if events_path is not None else None
+    clips = None
+    if evidence_dir is not None:
+        clip_fps = fps or 25
+        clips = ClipRecorder(evidence_dir, clip_fps, (width, height), int(round(clip_before * clip_fps)),
+                             int(round(clip_after * clip_fps)), draw=draw_annotations)
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Detect vehicles and filter out motorcycles
-        vehicles = detect_objects(vehicle_model, frame)
-        motorcycles = [d for d in vehicles if d['class'] == 3]  # Motorcycle class = 3
-        non_motorcycles = [d for d in vehicles if d['class'] != 3]  # Exclude motorcycles
+    if feature_embeddings:
+        embedder = FeatureEmbedder(vehicle_model)
+        tracker = initialize_tracker(tracker_backend, embedder=None)
+    else:
+        embedder = None
+        tracker = initialize_tracker(tracker_backend)
 
-        # Detect riders
-        riders = detect_objects(rider_model, frame)
+    frame_indices = count()
+    detect_indices = count()
+    frames = read_frames(cap)
+    if detection_cache is not None:
+        detection_cache.open(detect_width, tiling, roi, rider_classes, helmet_imgsz)
+        if (detection_cache.replay and headless and evidence_dir is None and tracker_backend == "iou"
+                and helmet_model is None and detect_stride == 1):
+            frames = blank_frames(detection_cache.frame_count(), width, height)
 
-        # Assign riders to motorcycles
-        assignments = assign_riders_to_motorcycles(motorcycles, riders)
+    def emit(frame_index, frame, tracks, trapeziums, triple_riding_detections, counts, track_ids=None):
+        if events is None and clips is None:
+            return
+        timestamp = frame_index / fps if fps else None
+        records = frame_events(frame_index, timestamp, tracks, trapeziums, triple_riding_detections, counts, track_ids)
+        if events is not None:
+            events.write(records)
+        if clips is not None:
+            boxes = [(record['ltrb'], record['class']) for record in records if record['type'] == 'track']
+            violations = [
+                record['track_id'] for record in records
+                if record['type'] == 'trapezium' and record['track_id'] is not None
+                and (record['triple_riding'] or record['no_helmets'])
+            ]
+            clips.add(frame_index, frame, boxes, triple_riding_detections, violations)
 
-        trapeziums = []
-        helmet_detections = []
-        triple_riding_detections = []
-        
-        for motorcycle_key, rider_list in assignments.items():
-            motorcycle = {'x': motorcycle_key[0], 'y': motorcycle_key[1], 'w': motorcycle_key[2], 'h': motorcycle_key[3]}
-            trapezium = create_trapezium(motorcycle, rider_list)
-            trapeziums.append(trapezium)
-            
-            # Detect helmets in the trapezium
-            helmet_count = len(detect_helmets(frame, helmet_model, trapezium))
-            rider_count = len(rider_list)
-            
-            if rider_count > 2 or helmet_count > 2:
-                triple_riding_detections.append(trapezium)
-        
-        # Convert trapezium to bounding boxes for tracking
-        trapezium_detections = [
-            {
-                'x': (min(p[0] for p in trapezium) + max(p[0] for p in trapezium)) / 2,
-                'y': (min(p[1] for p in trapezium) + max(p[1] for p in trapezium)) / 2,
-                'w': max(p[0] for p in trapezium) - min(p[0] for p in trapezium),
-                'h': max(p[1] for p in trapezium) - min(p[1] for p in trapezium),
-                'class': 'Trapezium'
-            }
-            for trapezium in trapeziums
-        ]
-        
-        all_detections = non_motorcycles + helmet_detections + trapezium_detections
-        tracks = update_tracker(tracker, all_detections, frame)
-        
-        # Draw tracked bounding boxes
-        for track in tracks:
-            if not track.is_confirmed():
-                continue
-            ltrb = track.to_ltrb()
-            class_name = track.get_det_class()
-            color = (255, 0, 0)  # Default color
-
-            if class_name in ['Helmet', 'No_Helmet']:
-                color = (0, 255, 0) if class_name == 'Helmet' else (0, 0, 255)
-            
-            cv2.rectangle(frame, (int(ltrb[0]), int(ltrb[1])), (int(ltrb[2]), int(ltrb[3])), color, 2)
-            cv2.putText(frame, class_name, (int(ltrb[0]), int(ltrb[1]) - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-        
-        # Draw triple riding bounding boxes
-        for trapezium in triple_riding_detections:
-            pts = np.array(trapezium, np.int32).reshape((-1, 1, 2))
-            cv2.polylines(frame, [pts], isClosed=True, color=(0, 0, 255), thickness=2)
-            cv2.putText(frame, "Triple Riding", (int(trapezium[0][0]), int(trapezium[0][1] - 5)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+    def detect_stage(frames):
+        indices = [next(detect_indices) for _ in frames]
+        return frames, detect_frames(frames, vehicle_model, rider_model, helmet_model, embedder, with_counts=True,
+                                     motion_gate=motion_gate, rider_classes=rider_classes, detect_width=detect_width,
+                                     tiling=tiling, roi=roi, cache=detection_cache, frame_indices=indices,
+                                     helmet_imgsz=helmet_imgsz)
 
-        out.write(frame)
-    
-    cap.release()
-    out.release()
+    def track_stage(item):
+        frames, results = item
+        annotated = []
+        for frame, (non_motorcycles, trapeziums, triple_riding_detections, embeddings, counts) in zip(frames, results):
+            tracks = track_frame(tracker, frame, non_motorcycles, trapeziums, embeddings)
+            emit(next(frame_indices), frame, tracks, trapeziums, triple_riding_detections, counts)
+            if out is not None:
+                annotated.append(annotate_frame(frame, tracks, triple_riding_detections))
+        return annotated
+
+    def write_stage(frames):
+        for frame in frames:
+            with stage("encode"):
+                out.write(frame)
+
+    if roi is not None:
+        print(f"ROI: detecting on {roi.inferred_fraction((height, width)) * 100:.1f}% of the frame")
+    profiler = enable_profiling() if profile else None
+    batches = batched(frames, batch_size, max_wait)
+    try:
+        if detect_stride > 1:
+            stride = DetectionStride(detect_stride, motion_threshold, uncertainty_threshold)
+            tracks = []
+            for frame_index, frame in enumerate(frames):
+                # One detect_width copy per frame serves the stride's motion check and the detection
+                small_frame = detection_frames([frame], detect_width)[0][0]
+                if stride.should_detect(small_frame, tracks):
+                    non_motorcycles, trapeziums, triple_riding_detections, embeddings, counts = detect_frame(
+                        frame, vehicle_model, rider_model, helmet_model, embedder, with_counts=True,
+                        motion_gate=motion_gate, rider_classes=rider_classes, detect_width=detect_width,
+                        tiling=tiling, roi=roi, cache=detection_cache, frame_index=frame_index,
+                        helmet_imgsz=helmet_imgsz, small_frame=small_frame)
+                    tracks = track_frame(tracker, frame, non_motorcycles, trapeziums, embeddings)
+                    stride.remember(small_frame, tracks, trapeziums, triple_riding_detections, counts)
+                    emit(next(frame_indices), frame, tracks, trapeziums, triple_riding_detections, counts)
+                else:
+                    with stage("tracker"):
+                        tracks = predict_tracker(tracker, frame)
+                    trapeziums, triple_riding_detections = stride.propagate(tracks)
+                    emit(next(frame_indices), frame, tracks, trapeziums, triple_riding_detections, stride.counts, stride.track_ids)
+                if out is not None:
+                    write_stage([annotate_frame(frame, tracks, triple_riding_detections)])
+            print(f"Full detection on {stride.detections} frames, tracker-propagated {stride.propagated} frames")
+        elif pipelined:
+            run_pipeline(batches, [detect_stage, track_stage], write_stage, queue_size=queue_size)
+        else:
+            for frames in batches:
+                write_stage(track_stage(detect_stage(frames)))
+    finally:
+        # Stops the batcher's reader thread before the capture it reads from is released
+        batches.close()
+        cap.release()
+        if out is not None:
+            out.release()
+        if events is not None:
+            events.close()
+        if clips is not None:
+            clips.close()
+        if embedder is not None:
+            embedder.close()
+        if profiler is not None:
+            disable_profiling()
+        if detection_cache is not None:
+            detection_cache.close()
+    if events is not None:
+        print(f"{events.count} events saved to {events_path}")
+    if clips is not None:
+        print(f"{len(clips.clips)} violation clips saved to {evidence_dir}")
+    if detection_cache is not None and detection_cache.helmet_misses:
+        print(f"Detection cache: {detection_cache.helmet_misses} helmet crops were not cached and not checked for helmets")
+    if motion_gate is not None:
+        stats = motion_gate.stats()
+        print(f"Motion gate: skipped {stats['skipped']} of {stats['frames']} frames, "
+              f"inferred {stats['inferred_fraction'] * 100:.1f}% of pixels")
+    if out is not None:
+        print(f"Output video saved to {output_path}")
+    if profiler is not None:
+        profiler.report()
+        return profiler.summary()
+
+def render_events(video_path, events, output_path="output_video.mp4"):
+    """
+    Draws recorded events onto the source video, giving the same video process_video writes.
+
+    :param events: Path of a .jsonl or .parquet event file, or an iterable of events in frame order.
+    """
+    if isinstance(events, str):
+        events = read_events(events)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print("Error: Could not open video!")
+        return
+
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+    by_frame = groupby(events, key=lambda event: event['frame'])
+    pending = next(by_frame, None)
+    try:
+        for frame_index, frame in enumerate(read_frames(cap)):
+            current = []
+            while pending is not None and pending[0] <= frame_index:
+                if pending[0] == frame_index:
+                    current = list(pending[1])
+                pending = next(by_frame, None)
+
+            boxes = [(event['ltrb'], event['class']) for event in current if event['type'] == 'track']
+            triple_riding_detections = [
+                event['trapezium'] for event in current
+                if event['type'] == 'trapezium' and event['triple_riding']
+            ]
+            out.write(draw_annotations(frame, boxes, triple_riding_detections))
+    finally:
+        cap.release()
+        out.release()
     print(f"Output video saved to {output_path}")
 
 
@@ -0,0 +1,96 @@
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+import numpy as np
+
+# Stages in pipeline order, for the report
+STAGES = ("decode", "vehicle_model", "rider_model", "assignment", "trapezium", "helmet_crop",
+          "helmet_model", "tracker", "draw", "encode")
+
+_NULL = nullcontext()
+_profiler = None
+
+class _Timer:
+    __slots__ = ('samples', 'start')
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self.start)
+
+class Profiler:
+    """ Collects the duration of every call of every stage and counts decoded frames. """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.frames = 0
+        self.started = time.perf_counter()
+        self.stopped = None
+
+    def stage(self, name):
+        return _Timer(self.samples[name])
+
+    def summary(self):
+        """
+        Summary of the run so far.
+
+        :return: Dict with 'frames', 'seconds', 'fps' and 'stages', which maps every stage to its
+                 call count, calls per frame, total seconds and p50/p95/p99 milliseconds per call.
+        """
+        seconds = (self.stopped or time.perf_counter()) - self.started
+        frames = self.frames
+        stages = {}
+        for name in list(STAGES) + sorted(set(self.samples) - set(STAGES)):
+            samples = self.samples.get(name)
+            if not samples:
+                continue
+            p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+            stages[name] = {
+                'calls': len(samples),
+                'calls_per_frame': len(samples) / frames if frames else 0.0,
+                'total': float(sum(samples)),
+                'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+            }
+        return {'frames': frames, 'seconds': seconds, 'fps': frames / seconds if seconds else 0.0, 'stages': stages}
+
+    def report(self):
+        """ Prints the summary as a table. """
+        summary = self.summary()
+        print(f"{summary['frames']} frames in {summary['seconds']:.2f} s ({summary['fps']:.1f} fps)")
+        print(f"{'stage':<14}{'calls/frame':>12}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, s in summary['stages'].items():
+            print(f"{name:<14}{s['calls_per_frame']:>12.2f}{s['total']:>10.2f}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['p99']:>10.2f}")
+
+def enable_profiling():
+    """ Starts collecting stage timings in this process and returns the new Profiler. """
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+def disable_profiling():
+    """ Stops collecting stage timings and returns the finished Profiler, if any. """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stopped = time.perf_counter()
+    return profiler
+
+def count_frame():
+    """ Counts one decoded frame. """
+    if _profiler is not None:
+        _profiler.frames += 1
+
+def stage(name):
+    """
+    Context manager timing one call of a stage.
+
+    While profiling is disabled this returns a shared no-op context, so instrumented code costs
+    a function call per stage. Only one profiled run at a time per process.
+    """
+    if _profiler is None:
+        return _NULL
+    return _profiler.stage(name)
@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+from motion_gate import _merge_boxes
+
+class RoiMask:
+    """
+    Static region of interest of one camera: the road polygons where relevant motorcycles can be.
+
+    The detectors only see the bounding crops of the polygons, and detections whose centres fall
+    outside every polygon are dropped before rider assignment and tracking. Sky, buildings and
+    footpaths outside the road are then never inferred on.
+    """
+
+    def __init__(self, polygons, pad=16):
+        """
+        :param polygons: One polygon or a list of polygons, each a list of (x, y) points in
+                         full-resolution pixels.
+        :param pad: Pixels added around every polygon's crop so objects at the road edge are not cut.
+        """
+        polygons = [np.asarray(polygon, np.float32) for polygon in polygons]
+        if polygons and polygons[0].ndim == 1:
+            polygons = [np.stack(polygons)]
+        if not polygons or any(polygon.ndim != 2 or len(polygon) < 3 for polygon in polygons):
+            raise ValueError("An ROI needs at least one polygon of three or more (x, y) points")
+        self.polygons = polygons
+        self.pad = pad
+        self._mask = None
+
+    def boxes(self, frame_shape, scale=1.0):
+        """
+        Bounding crops of the polygons, merged where they overlap.
+
+        :param frame_shape: Shape of the full-resolution frame.
+        :param scale: Downscale factor of the frame the crops are for (full resolution / its size).
+        :return: List of (x1, y1, x2, y2) integer boxes in the coordinates of that frame.
+        """
+        h, w = frame_shape[:2]
+        boxes = []
+        for polygon in self.polygons:
+            x1, y1 = polygon.min(axis=0) - self.pad
+            x2, y2 = polygon.max(axis=0) + self.pad
+            boxes.append([
+                max(0, int(x1 / scale)), max(0, int(y1 / scale)),
+                min(int(np.ceil(w / scale)), int(np.ceil(x2 / scale))), min(int(np.ceil(h / scale)), int(np.ceil(y2 / scale))),
+            ])
+        return [box for box in _merge_boxes(boxes) if box[2] > box[0] and box[3] > box[1]]
+
+    def mask(self, frame_shape):
+        """ uint8 mask of the polygons at full resolution, built once per frame size. """
+        if self._mask is None or self._mask.shape != tuple(frame_shape[:2]):
+            self._mask = np.zeros(frame_shape[:2], np.uint8)
+            cv2.fillPoly(self._mask, [np.round(polygon).astype(np.int32) for polygon in self.polygons], 1)
+        return self._mask
+
+    def inside(self, detections, frame_shape):
+        """ The Detections (in full-resolution coordinates) whose centres lie inside the ROI. """
+        if not len(detections):
+            return detections
+        mask = self.mask(frame_shape)
+        x = np.clip(detections.xywh[:, 0].astype(np.int64), 0, mask.shape[1] - 1)
+        y = np.clip(detections.xywh[:, 1].astype(np.int64), 0, mask.shape[0] - 1)
+        return detections[mask[y, x] > 0]
+
+    def inferred_fraction(self, frame_shape):
+        """ Fraction of the frame's pixels inside the crops the detectors see. """
+        h, w = frame_shape[:2]
+        return sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in self.boxes(frame_shape)) / (w * h)
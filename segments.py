@@ -0,0 +1,208 @@
+import os
+import shutil
+import tempfile
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from detect_objects import THRESHOLDS
+from tracking import initialize_tracker, match_trapezium_tracks
+from process_video import read_frames, detect_frame, track_frame, annotate_frame
+from utils import iou_matrix
+
+def split_segments(frame_count, n_segments, overlap):
+    """
+    Splits frame_count frames into n_segments contiguous segments.
+
+    Every segment but the first starts reading overlap frames early, so its tracker is warm
+    by the time its own frames begin and its tracks can be stitched to the previous segment.
+
+    :return: List of (read_start, own_start, end) frame indices.
+    """
+    bounds = np.linspace(0, frame_count, n_segments + 1).astype(int)
+    return [
+        (max(0, int(a) - overlap) if i else 0, int(a), int(b))
+        for i, (a, b) in enumerate(zip(bounds[:-1], bounds[1:]))
+        if b > a
+    ]
+
+def _process_segment(video_path, model_paths, read_start, own_start, end, segment_path, tracker_backend, model_loader,
+                     thresholds):
+    """ Process one segment in a worker process and return its per-frame track records. """
+    # A spawned worker re-imports detect_objects with the default thresholds
+    THRESHOLDS.update(thresholds)
+    if model_loader is None:
+        from ultralytics import YOLO
+        model_loader = YOLO
+    vehicle_model, rider_model, helmet_model = (model_loader(path) if path else None for path in model_paths)
+
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, read_start)
+    out = None
+    if segment_path is not None:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(segment_path, fourcc, cap.get(cv2.CAP_PROP_FPS), (width, height))
+
+    tracker = initialize_tracker(tracker_backend)
+    records = []
+    try:
+        for index, frame in enumerate(read_frames(cap), start=read_start):
+            if index >= end:
+                break
+            non_motorcycles, trapeziums, triple_riding_detections, embeddings = detect_frame(frame, vehicle_model, rider_model, helmet_model)
+            tracks = track_frame(tracker, frame, non_motorcycles, trapeziums, embeddings)
+
+            triple_ids = {id(t) for t in triple_riding_detections}
+            records.append({
+                'frame': index,
+                'tracks': [
+                    (track.track_id, track.get_det_class(), [float(v) for v in track.to_ltrb()])
+                    for track in tracks if track.is_confirmed()
+                ],
+                'violations': [
+                    track.track_id for track, i in match_trapezium_tracks(tracks, trapeziums)
+                    if id(trapeziums[i]) in triple_ids
+                ],
+            })
+
+            if out is not None and index >= own_start:
+                out.write(annotate_frame(frame, tracks, triple_riding_detections))
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+    return records
+
+def stitch_segments(segment_records, segments, min_iou=0.5):
+    """
+    Maps every segment's local track IDs onto global IDs.
+
+    A track of segment s inherits the global ID of the segment s-1 track it overlaps most
+    (mean IoU over the shared frames, same class, at least min_iou); every other track gets a
+    new global ID. Only each segment's own frames are kept, so no frame is counted twice.
+
+    :return: Tuple of (records with global track IDs, Counter of violation frames per global ID).
+    """
+    global_ids = {}
+    next_id = 1
+    records_out = []
+    violations = Counter()
+
+    for s, records in enumerate(segment_records):
+        mapping = {}
+        if s > 0:
+            previous = {r['frame']: r for r in segment_records[s - 1]}
+            scores = defaultdict(list)
+            for record in records:
+                if record['frame'] >= segments[s][1]:
+                    break
+                prev = previous.get(record['frame'])
+                if not prev or not record['tracks'] or not prev['tracks']:
+                    continue
+                ious = iou_matrix(
+                    np.array([box for _, _, box in record['tracks']], np.float32),
+                    np.array([box for _, _, box in prev['tracks']], np.float32),
+                )
+                for i, (track_id, class_name, _) in enumerate(record['tracks']):
+                    for j, (prev_id, prev_class, _) in enumerate(prev['tracks']):
+                        if class_name == prev_class:
+                            scores[(track_id, prev_id)].append(ious[i, j])
+
+            used = set()
+            for (track_id, prev_id), values in sorted(scores.items(), key=lambda kv: -np.mean(kv[1])):
+                if np.mean(values) < min_iou:
+                    break
+                if track_id in mapping or prev_id in used or (s - 1, prev_id) not in global_ids:
+                    continue
+                mapping[track_id] = global_ids[(s - 1, prev_id)]
+                used.add(prev_id)
+
+        for record in records:
+            for track_id, _, _ in record['tracks']:
+                if (s, track_id) not in global_ids:
+                    if track_id in mapping:
+                        global_ids[(s, track_id)] = mapping[track_id]
+                    else:
+                        global_ids[(s, track_id)] = next_id
+                        next_id += 1
+
+            if record['frame'] < segments[s][1]:
+                continue
+            records_out.append({
+                'frame': record['frame'],
+                'tracks': [(global_ids[(s, t)], c, box) for t, c, box in record['tracks']],
+                'violations': [global_ids[(s, t)] for t in record['violations']],
+            })
+            violations.update(global_ids[(s, t)] for t in record['violations'])
+
+    return records_out, violations
+
+def _concat_videos(paths, output_path):
+    """ Joins the segment videos, in order, into one output video. """
+    writer = None
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        if writer is None:
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            writer = cv2.VideoWriter(output_path, fourcc, cap.get(cv2.CAP_PROP_FPS), (width, height))
+        for frame in read_frames(cap):
+            writer.write(frame)
+        cap.release()
+    if writer is not None:
+        writer.release()
+
+def process_video_parallel(video_path, model_paths, output_path=None, workers=None, n_segments=None,
+                           overlap=30, tracker_backend="deepsort", model_loader=None):
+    """
+    Processes a long recording as overlapping time segments in a process pool.
+
+    Each worker loads its own models, seeks to its segment and runs the usual
+    detect/track/annotate loop with the caller's THRESHOLDS. Track IDs are stitched across segment boundaries afterwards,
+    so IDs and per-track violation counts are global.
+
+    :param model_paths: (vehicle, rider, helmet) weight paths; workers load them with model_loader.
+                        A rider path of None makes the vehicle weights a merged vehicle + rider model.
+    :param output_path: Optional path of the joined annotated video.
+    :param workers: Number of worker processes (default: CPU count).
+    :param n_segments: Number of segments (default: workers).
+    :param overlap: Frames each segment re-processes before its start; should exceed the tracker's n_init.
+    :param model_loader: Picklable callable that loads a model from a path (default: ultralytics.YOLO).
+    :return: Tuple of (per-frame records with global track IDs, Counter of violation frames per track).
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print("Error: Could not open video!")
+        return [], Counter()
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    workers = workers or os.cpu_count() or 1
+    segments = split_segments(frame_count, n_segments or workers, overlap)
+
+    temp_dir = tempfile.mkdtemp() if output_path is not None else None
+    segment_paths = [
+        os.path.join(temp_dir, f"segment_{i}.mp4") if temp_dir else None
+        for i in range(len(segments))
+    ]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_process_segment, video_path, model_paths, read_start, own_start, end,
+                            segment_path, tracker_backend, model_loader, dict(THRESHOLDS))
+                for (read_start, own_start, end), segment_path in zip(segments, segment_paths)
+            ]
+            segment_records = [future.result() for future in futures]
+
+        records, violations = stitch_segments(segment_records, segments)
+        if output_path is not None:
+            _concat_videos(segment_paths, output_path)
+            print(f"Output video saved to {output_path}")
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return records, violations
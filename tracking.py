@@ -1,11 +1,87 @@
-from deep_sort_realtime.deepsort_tracker import DeepSort
+import numpy as np
+from detect_objects import THRESHOLDS
+from detections import as_detections
+from trapezium import trapezium_envelopes
+from utils import iou_matrix
 
-def initialize_tracker():
-    return DeepSort(max_age=30, n_init=3, nn_budget=100)
+TRACKER_BACKENDS = ("deepsort", "iou")
 
-def update_tracker(tracker, detections, frame):
+def initialize_tracker(backend="deepsort", **kwargs):
+    """
+    Builds a tracker for the selected backend.
+
+    :param backend: "deepsort" for DeepSORT with its appearance embedder (better re-identification),
+                    or "iou" for the motion-only Kalman + IoU tracker (no second CNN, much faster).
+                    Pass embedder=None with "deepsort" to feed it precomputed embeddings instead.
+    :param kwargs: Overrides for the backend's constructor arguments.
+    """
+    if backend == "deepsort":
+        from deep_sort_realtime.deepsort_tracker import DeepSort
+        return DeepSort(**{'max_age': 30, 'n_init': 3, 'nn_budget': 100, **kwargs})
+    if backend == "iou":
+        from iou_tracker import IoUTracker
+        return IoUTracker(**{'max_age': 30, 'n_init': 3, **kwargs})
+    raise ValueError(f"Unknown tracker backend: {backend} (expected one of {TRACKER_BACKENDS})")
+
+def update_tracker(tracker, detections, frame, embeddings=None, skip_motorcycles=True):
+    """
+    Update the tracker with Detections or a list of detection dicts, skipping motorcycles.
+
+    :param embeddings: Optional (N, D) array with one appearance embedding per detection, used
+                       instead of the tracker's own embedder.
+    :param skip_motorcycles: Drop motorcycle detections, which process_video tracks through their
+                             trapeziums. Pass False to track the motorcycles themselves.
+    """
+    detections = as_detections(detections)
+    keep = np.ones(len(detections), bool)
+    if skip_motorcycles:
+        keep &= detections.cls != THRESHOLDS['motorcycle_class']
+    if embeddings is not None:
+        # DeepSORT drops empty boxes itself, which would misalign the embeddings
+        keep &= (detections.xywh[:, 2] > 0) & (detections.xywh[:, 3] > 0)
     formatted_detections = [
-        ([d['x'] - d['w'] / 2, d['y'] - d['h'] / 2, d['w'], d['h']], 0.6, str(d['class']))
-        for d in detections if d['class'] != 3
+        (box, conf, str(class_id))
+        for box, conf, class_id in zip(detections.ltwh[keep].tolist(), detections.conf[keep].tolist(), detections.cls[keep])
     ]
+    if embeddings is not None:
+        return tracker.update_tracks(formatted_detections, embeds=list(embeddings[keep]), frame=frame)
     return tracker.update_tracks(formatted_detections, frame=frame)
+
+def predict_tracker(tracker, frame):
+    """
+    Advance the tracker by one frame without detections, so tracks coast on their motion model.
+
+    Only the Kalman states are predicted. An update with no detections would count as a miss and
+    delete every tentative track, so no track could collect the hits it needs to be confirmed.
+    """
+    if hasattr(tracker, 'predict_tracks'):
+        return tracker.predict_tracks()
+    # deep_sort_realtime's DeepSort keeps its tracks in an inner Tracker
+    tracker.tracker.predict()
+    return tracker.tracker.tracks
+
+def track_uncertainty(track):
+    """ Kalman position uncertainty of a track, as its position std relative to its box height. """
+    covariance = getattr(track, 'covariance', None)
+    mean = getattr(track, 'mean', None)
+    if covariance is None or mean is None:
+        return 0.0
+    return float((covariance[0][0] + covariance[1][1]) ** 0.5 / max(float(mean[3]), 1.0))
+
+def match_trapezium_tracks(tracks, trapeziums):
+    """
+    Pairs every confirmed Trapezium track updated this frame with the trapezium it was updated with.
+
+    :return: List of (track, trapezium index) pairs.
+    """
+    trapezium_tracks = [
+        track for track in tracks
+        if track.is_confirmed() and track.get_det_class() == 'Trapezium' and track.time_since_update == 0
+    ]
+    if not trapezium_tracks or not len(trapeziums):
+        return []
+
+    # Matched tracks report the detection box they were updated with
+    detected_boxes = np.array([track.to_ltrb(orig=True) for track in trapezium_tracks], np.float32)
+    ious = iou_matrix(detected_boxes, trapezium_envelopes(trapeziums))
+    return list(zip(trapezium_tracks, np.argmax(ious, axis=1).tolist()))
@@ -1,73 +1,6 @@
-# import numpy as np
-# import cv2
-# from shapely.geometry import Polygon
-
-# def bbox_to_polygon(bbox):
-#     """ Convert bounding box (x, y, w, h) to a polygon representation. """
-#     x, y, w, h = bbox['x'], bbox['y'], bbox['w'], bbox['h']
-#     return np.array([
-#         [x - w / 2, y - h / 2],  # Top-left
-#         [x + w / 2, y - h / 2],  # Top-right
-#         [x + w / 2, y + h / 2],  # Bottom-right
-#         [x - w / 2, y + h / 2]   # Bottom-left
-#     ], dtype=np.float32)
-
-# def iou(polygon1, polygon2):
-#     """ Calculate the Intersection over Union (IoU) of two polygons. """
-#     poly1 = Polygon(polygon1)
-#     poly2 = Polygon(polygon2)
-    
-#     if poly1.is_valid and poly2.is_valid:
-#         intersection = poly1.intersection(poly2).area
-#         union = poly1.union(poly2).area
-#         return intersection / union if union != 0 else 0
-#     return 0
-
-# def create_trapezium(motorcycle, riders):
-#     """ Generate a trapezium bounding box that efficiently encloses a motorcycle and its riders. """
-#     if not riders:
-#         return bbox_to_polygon(motorcycle)  # If no riders, return motorcycle bbox as polygon
-    
-#     # Collect all points from the motorcycle and riders
-#     combined_points = [bbox_to_polygon(motorcycle)]
-#     for rider in riders:
-#         combined_points.append(bbox_to_polygon(rider))
-    
-#     combined_points = np.vstack(combined_points)  # Stack all points together
-#     hull = cv2.convexHull(combined_points)  # Compute convex hull
-    
-#     return hull.reshape(-1, 2).tolist() if len(hull) > 2 else combined_points.tolist()
-
-# def assign_riders_to_motorcycles(motorcycles, riders, iou_threshold=0.5):
-#     """ Assign riders to motorcycles based on IoU threshold. """
-#     assignments = {}
-    
-#     if motorcycles:  # If there is at least one motorcycle
-#         motorcycle = motorcycles[0]  # Only take the first motorcycle
-#         motorcycle_bbox = {'x': motorcycle['x'], 'y': motorcycle['y'], 'w': motorcycle['w'], 'h': motorcycle['h']}
-#         motorcycle_polygon = bbox_to_polygon(motorcycle_bbox)
-        
-#         assigned_riders = []
-        
-#         # Check IoU for each rider
-#         for rider in riders:
-#             rider_bbox = {'x': rider['x'], 'y': rider['y'], 'w': rider['w'], 'h': rider['h']}
-#             rider_polygon = bbox_to_polygon(rider_bbox)
-            
-#             # Calculate IoU
-#             iou_score = iou(motorcycle_polygon, rider_polygon)
-            
-#             # Assign rider to motorcycle if IoU exceeds the threshold
-#             if iou_score >= iou_threshold:
-#                 assigned_riders.append(rider)
-        
-#         assignments[(motorcycle_bbox['x'], motorcycle_bbox['y'], motorcycle_bbox['w'], motorcycle_bbox['h'])] = assigned_riders
-    
-#     return assignments
-
 import numpy as np
 import cv2
-from shapely.geometry import Polygon
+from detections import as_detections
 
 def bbox_to_polygon(bbox):
     """ Convert bounding box (x, y, w, h) to a polygon representation. """
@@ -79,19 +12,80 @@ def bbox_to_polygon(bbox):
         [x - w / 2, y + h / 2]   # Bottom-left
     ], dtype=np.float32)
 
+def boxes_to_polygons(xywh):
+    """ Convert an (N, 4) array of (x, y, w, h) boxes to an (N, 4, 2) array of polygons. """
+    x, y, w, h = (np.asarray(xywh, np.float32).reshape(-1, 4)[:, i] for i in range(4))
+    return np.stack([
+        np.stack([x - w / 2, y - h / 2], axis=1),  # Top-left
+        np.stack([x + w / 2, y - h / 2], axis=1),  # Top-right
+        np.stack([x + w / 2, y + h / 2], axis=1),  # Bottom-right
+        np.stack([x - w / 2, y + h / 2], axis=1)   # Bottom-left
+    ], axis=1)
+
 def create_trapezium(motorcycle, riders):
     """ Generate a trapezium bounding box that efficiently encloses a motorcycle and its riders. """
-    if not riders:
+    if not len(riders):
         return bbox_to_polygon(motorcycle)  # If no riders, return motorcycle bbox as polygon
     
-    # Collect all points from the motorcycle and riders
-    combined_points = [bbox_to_polygon(motorcycle)]
-    for rider in riders:
-        combined_points.append(bbox_to_polygon(rider))
-    
-    combined_points = np.vstack(combined_points)  # Stack all points together
+    # Collect all points from the motorcycle and riders (Detections or list of dicts)
+    rider_points = boxes_to_polygons(as_detections(riders).xywh).reshape(-1, 2)
+    combined_points = np.vstack([bbox_to_polygon(motorcycle), rider_points])  # Stack all points together
     hull = cv2.convexHull(combined_points)  # Compute convex hull
     
     return hull.reshape(-1, 2).tolist() if len(hull) > 2 else combined_points.tolist()
 
+def build_trapeziums(motorcycles, assignments, frame_shape=None):
+    """
+    Builds the trapeziums of all motorcycles of a frame and their envelopes in one pass.
+
+    Every motorcycle's and rider's corners are computed in two vectorised calls; only the convex
+    hull itself runs per motorcycle. Hulls and envelopes are clipped to the frame.
+
+    :param motorcycles: Detections of the frame's motorcycles.
+    :param assignments: Dict of motorcycle index -> rider Detections, from assign_riders_to_motorcycles.
+    :param frame_shape: Shape of the frame to clip to; None leaves them unclipped.
+    :return: Tuple of (list of (K, 2) float32 trapezium arrays, (N, 4) float32 array of their
+             (x1, y1, x2, y2) envelopes), in the order of assignments.
+    """
+    if not assignments:
+        return [], np.zeros((0, 4), np.float32)
+
+    indices = list(assignments)
+    rider_groups = [as_detections(riders) for riders in assignments.values()]
+    motorcycle_corners = boxes_to_polygons(as_detections(motorcycles).xywh[indices])
+    rider_corners = boxes_to_polygons(np.concatenate([riders.xywh for riders in rider_groups]))
+    rider_corners = np.split(rider_corners, np.cumsum([len(riders) for riders in rider_groups])[:-1])
+
+    groups = [np.vstack([m, r.reshape(-1, 2)]) for m, r in zip(motorcycle_corners, rider_corners)]
+    lengths = [len(points) for points in groups]
+    points = np.concatenate(groups)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    envelopes = np.concatenate([np.minimum.reduceat(points, offsets), np.maximum.reduceat(points, offsets)], axis=1)
+
+    trapeziums = []
+    for group, riders in zip(groups, rider_groups):
+        if not len(riders):
+            trapeziums.append(group)
+            continue
+        hull = cv2.convexHull(group).reshape(-1, 2)
+        trapeziums.append(hull if len(hull) > 2 else group)
+
+    if frame_shape is not None:
+        h, w = frame_shape[:2]
+        for trapezium in trapeziums:
+            np.clip(trapezium, 0, [w, h], out=trapezium)
+        np.clip(envelopes, 0, [w, h, w, h], out=envelopes)
+    return trapeziums, envelopes
 
+def trapezium_envelopes(trapeziums, frame_shape=None):
+    """ (N, 4) array of the (x1, y1, x2, y2) envelope of every trapezium, optionally clipped to the frame. """
+    if not len(trapeziums):
+        return np.zeros((0, 4), np.float32)
+    groups = [np.asarray(t, np.float32).reshape(-1, 2) for t in trapeziums]
+    points = np.concatenate(groups)
+    offsets = np.concatenate([[0], np.cumsum([len(g) for g in groups])[:-1]])
+    envelopes = np.concatenate([np.minimum.reduceat(points, offsets), np.maximum.reduceat(points, offsets)], axis=1)
+    if frame_shape is not None:
+        h, w = frame_shape[:2]
+        np.clip(envelopes, 0, [w, h, w, h], out=envelopes)
+    return envelopes
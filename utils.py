@@ -1,35 +1,76 @@
-from shapely.geometry import Polygon
-from trapezium import bbox_to_polygon
+import numpy as np
+from detections import as_detections
+
 def iou(bbox1, bbox2):
-    poly1 = Polygon(bbox1)
-    poly2 = Polygon(bbox2)
-    
-    if not poly1.is_valid or not poly2.is_valid:
-        return 0.0
-    
-    intersection = poly1.intersection(poly2)
-    if intersection.is_empty:
-        return 0.0
-    
-    return intersection.area / (poly1.area + poly2.area - intersection.area)
-
-def assign_riders_to_motorcycles(motorcycles, riders):
+    """ IoU of two axis-aligned boxes given as polygons (e.g. from bbox_to_polygon). """
+    bbox1 = np.asarray(bbox1, np.float32)
+    bbox2 = np.asarray(bbox2, np.float32)
+    box1 = np.concatenate([bbox1.min(axis=0), bbox1.max(axis=0)])[None]
+    box2 = np.concatenate([bbox2.min(axis=0), bbox2.max(axis=0)])[None]
+    return float(iou_matrix(box1, box2)[0, 0])
+
+def iou_matrix(boxes1, boxes2):
+    """
+    IoU of every box in boxes1 against every box in boxes2.
+
+    :param boxes1: (N, 4) array of (x1, y1, x2, y2) boxes.
+    :param boxes2: (M, 4) array of (x1, y1, x2, y2) boxes.
+    :return: (N, M) array of IoU values.
+    """
+    w = np.minimum(boxes1[:, None, 2], boxes2[None, :, 2]) - np.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+    h = np.minimum(boxes1[:, None, 3], boxes2[None, :, 3]) - np.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+    intersection = np.maximum(w, 0) * np.maximum(h, 0)
+
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    union = area1[:, None] + area2[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+def assign_riders_to_motorcycles(motorcycles, riders, method="greedy", iou_threshold=0.0, max_riders=4):
+    """
+    Assign riders to motorcycles from the riders x motorcycles IoU matrix.
+
+    :param motorcycles: Detections (or list of detection dicts) of motorcycles.
+    :param riders: Detections (or list of detection dicts) of riders.
+    :param method: "greedy" gives every rider to the motorcycle it overlaps most. "optimal"
+                   maximises the total IoU with at most max_riders riders per motorcycle
+                   (requires scipy).
+    :param iou_threshold: Riders whose best IoU is not above this stay unassigned.
+    :param max_riders: Capacity of a motorcycle in "optimal" mode.
+    :return: Dict mapping a motorcycle's index in motorcycles to the Detections of its riders,
+             ordered by each motorcycle's first assigned rider.
+    """
+    motorcycles = as_detections(motorcycles)
+    riders = as_detections(riders)
+    if not len(motorcycles) or not len(riders):
+        return {}
+
+    ious = iou_matrix(riders.xyxy, motorcycles.xyxy)
+
+    if method == "greedy":
+        rider_indices = np.arange(len(riders))
+        best = np.argmax(ious, axis=1)
+        valid = ious[rider_indices, best] > iou_threshold
+        rider_indices, best = rider_indices[valid], best[valid]
+    elif method == "optimal":
+        from scipy.optimize import linear_sum_assignment
+
+        # One column per free seat, so a motorcycle can take up to max_riders riders
+        seats = np.repeat(ious, max_riders, axis=1)
+        rider_indices, seat_indices = linear_sum_assignment(seats, maximize=True)
+        best = seat_indices // max_riders
+        valid = ious[rider_indices, best] > iou_threshold
+        rider_indices, best = rider_indices[valid], best[valid]
+    else:
+        raise ValueError(f"Unknown assignment method: {method}")
+
+    # Group riders by motorcycle with one gather, then hand out slices of it
+    order = np.argsort(best, kind="stable")
+    rider_indices = rider_indices[order]
+    grouped = riders[rider_indices]
+    motorcycle_indices, starts, counts = np.unique(best[order], return_index=True, return_counts=True)
+
     assignments = {}
-    
-    for rider in riders:
-        best_iou = 0
-        best_motorcycle = None
-        
-        for motorcycle in motorcycles:
-            current_iou = iou(bbox_to_polygon(motorcycle), bbox_to_polygon(rider))
-            if current_iou > best_iou:
-                best_iou = current_iou
-                best_motorcycle = motorcycle
-        
-        if best_motorcycle:
-            key = (best_motorcycle['x'], best_motorcycle['y'], best_motorcycle['w'], best_motorcycle['h'])
-            if key not in assignments:
-                assignments[key] = []
-            assignments[key].append(rider)
-    
+    for k in np.argsort(rider_indices[starts]).tolist():
+        assignments[int(motorcycle_indices[k])] = grouped[int(starts[k]):int(starts[k] + counts[k])]
     return assignments
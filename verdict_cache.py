@@ -0,0 +1,65 @@
+import numpy as np
+from utils import iou_matrix
+
+class VerdictCache:
+    """
+    Caches the trapezium, helmet detections and rider count of every motorcycle track.
+
+    A cached verdict is reused while the track's box stays close to where it was when the
+    verdict was made. It is refreshed when the box IoU drops below iou_threshold, when the
+    weakest helmet detection was less confident than min_confidence or no helmet was found on
+    a motorcycle with riders, or once it is max_age frames old. Entries of tracks DeepSORT has dropped are evicted.
+    """
+
+    def __init__(self, max_age=30, iou_threshold=0.7, min_confidence=0.5):
+        self.max_age = max_age
+        self.iou_threshold = iou_threshold
+        self.min_confidence = min_confidence
+        self.entries = {}  # track_id -> dict(ltrb, trapezium, helmets, rider_count, confidence, age)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, track_id, ltrb):
+        """
+        Returns the cached verdict moved to the track's current box, or None if it needs a refresh.
+
+        :return: Tuple of (trapezium, helmets, rider_count) or None.
+        """
+        entry = self.entries.get(track_id)
+        if entry is None or entry['age'] >= self.max_age or entry['confidence'] < self.min_confidence:
+            self.misses += 1
+            return None
+
+        ltrb = np.asarray(ltrb, np.float32)
+        if iou_matrix(entry['ltrb'][None], ltrb[None])[0, 0] < self.iou_threshold:
+            self.misses += 1
+            return None
+
+        entry['age'] += 1
+        self.hits += 1
+        dx, dy = (ltrb[:2] + ltrb[2:]) / 2 - (entry['ltrb'][:2] + entry['ltrb'][2:]) / 2
+        trapezium = (entry['trapezium'] + [dx, dy]).tolist()
+        return trapezium, entry['helmets'].offset(dx, dy), entry['rider_count']
+
+    def store(self, track_id, ltrb, trapezium, helmets, rider_count):
+        """ Records a fresh verdict for a track. """
+        if len(helmets):
+            confidence = float(helmets.conf.min())
+        else:
+            # Riders without any helmet or no-helmet detection were likely missed; check them again next frame
+            confidence = 0.0 if rider_count > 0 else 1.0
+        self.entries[track_id] = {
+            'ltrb': np.asarray(ltrb, np.float32),
+            'trapezium': np.asarray(trapezium, np.float32),
+            'helmets': helmets,
+            'rider_count': rider_count,
+            'confidence': confidence,
+            'age': 0,
+        }
+
+    def evict(self, live_track_ids):
+        """ Drops the verdicts of tracks that are no longer alive. """
+        live_track_ids = set(live_track_ids)
+        for track_id in list(self.entries):
+            if track_id not in live_track_ids:
+                del self.entries[track_id]